@@ -1,27 +1,76 @@
 import argparse
+import bisect
+import collections
+import concurrent.futures
+import heapq
+import itertools
 import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
 from tqdm import tqdm
 import cv2
 import numpy as np
-import pandas as pd
-from scipy.ndimage import gaussian_filter
-import matplotlib.pyplot as plt
+
+import export_cache
+import heatmap_store
 
 """
-The load_reference_video function takes in a video path and returns a list of frames.
+The iter_capture_frames function yields the frames of an already opened cv2.VideoCapture one at
+a time and releases the capture once it is exhausted. An optional scale factor below 1.0
+downscales every frame before it is yielded. With buffer_count above 0 frames are decoded into
+a ring of that many preallocated arrays, so a yielded frame is overwritten buffer_count frames later.
 """
-def load_reference_video(video_path):
-    cap = cv2.VideoCapture(video_path)
-    frames = []
+def iter_capture_frames(cap, scale=1.0, buffer_count=0):
+    decoded = [None] * max(buffer_count, 1)
+    scaled = [None] * max(buffer_count, 1)
+    slot = 0
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read(decoded[slot if scale == 1.0 else 0])
+            if not ret:
+                break
+            if buffer_count:
+                if scale == 1.0:
+                    decoded[slot] = frame
+                else:
+                    # The full-size frame is consumed by the resize, so one buffer is enough
+                    decoded[0] = frame
+                    frame = cv2.resize(frame, None, scaled[slot], fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                    scaled[slot] = frame
+                slot = (slot + 1) % buffer_count
+            elif scale != 1.0:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            yield frame
+    finally:
+        cap.release()
 
+"""
+The iter_reference_video function takes in a video path and yields its frames one at a time,
+so only a single decoded frame is held in memory.
+"""
+def iter_reference_video(video_path, scale=1.0):
+    return iter_capture_frames(cv2.VideoCapture(video_path), scale)
+
+"""
+The load_reference_video function takes in a video path and returns a list of frames.
+Prefer iter_reference_video for long recordings, this keeps every frame in memory.
+"""
+def load_reference_video(video_path, scale=1.0):
+    return list(iter_reference_video(video_path, scale))
+
+"""
+The get_video_frame_count function returns the number of frames reported by the container.
+"""
+def get_video_frame_count(video_path):
+    cap = cv2.VideoCapture(video_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     cap.release()
-    return frames
+    return frame_count
 
 """
 The get_video_frame_rate function returns the frame rate of the video.
@@ -33,43 +82,445 @@ def get_video_frame_rate(video_path):
     return frame_rate
 
 """
-Generate heatmap video from gaze data.
+GazeFrameIndex groups the gaze samples by world_index once, so the samples belonging to a
+frame are a contiguous slice of sorted NumPy columns found with two offset lookups.
+from_dataframe() drops samples without a frame or position, which the export cache keeps as NaN
+in float64 columns.
 """
-def generate_heatmap_video(video_path, gaze_positions, output_path, frame_rate):
-    surface_df = pd.read_csv(gaze_positions)
+class GazeFrameIndex:
+    def __init__(self, world_index, norm_pos_x, norm_pos_y):
+        world_index = np.asarray(world_index)
+        norm_pos_x = np.asarray(norm_pos_x)
+        norm_pos_y = np.asarray(norm_pos_y)
 
-    # Check if required columns exist
-    if not {'world_index', 'norm_pos_x', 'norm_pos_y'}.issubset(surface_df.columns):
-        print("Error: CSV file does not contain required columns.")
-        return
+        if len(world_index) and np.any(np.diff(world_index) < 0):
+            order = np.argsort(world_index, kind='stable')
+            world_index = world_index[order]
+            norm_pos_x = norm_pos_x[order]
+            norm_pos_y = norm_pos_y[order]
 
-    reference_frames = load_reference_video(video_path)
-    if not reference_frames:
-        print("Error: No frames loaded from video.")
-        return
+        self.norm_pos_x = norm_pos_x
+        self.norm_pos_y = norm_pos_y
+        self.first_index = int(world_index[0]) if len(world_index) else 0
+        last_index = int(world_index[-1]) if len(world_index) else -1
 
-    height, width, _ = reference_frames[0].shape
-    grid = (height // 2, width // 2)
+        # offsets[k]:offsets[k + 1] is the slice holding world_index == first_index + k
+        frame_ids = np.arange(self.first_index, last_index + 2)
+        self.offsets = np.searchsorted(world_index, frame_ids, side='left')
 
-    # Setup video writer
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    video_writer = cv2.VideoWriter(output_path, fourcc, frame_rate, (width, height))
+    @classmethod
+    def from_dataframe(cls, surface_df):
+        columns = ['world_index', 'norm_pos_x', 'norm_pos_y']
+        # Only copy when needed, so the columns stay memory-mapped from the export cache
+        missing = surface_df[columns].isna().any(axis=1).to_numpy()
+        if missing.any():
+            surface_df = surface_df[~missing]
+        world_index = surface_df['world_index'].values
+        if world_index.dtype.kind == 'f':
+            world_index = world_index.astype(np.int64)
+        return cls(world_index, surface_df['norm_pos_x'].values, surface_df['norm_pos_y'].values)
 
-    offset = surface_df['world_index'].min()
+    def samples(self, world_index):
+        """Return (norm_pos_x, norm_pos_y) views for a frame, or None if it has no gaze."""
+        k = world_index - self.first_index
+        if k < 0 or k >= len(self.offsets) - 1:
+            return None
+        start, end = self.offsets[k], self.offsets[k + 1]
+        if start == end:
+            return None
+        return self.norm_pos_x[start:end], self.norm_pos_y[start:end]
 
-    for frame_idx, reference_frame in tqdm(enumerate(reference_frames), total=len(reference_frames)):
-        world_index = frame_idx + offset
+"""
+HistogramKernel is the reference heatmap: a density histogram of the gaze points on a coarse
+grid, blurred with scipy's gaussian_filter. Kernels are called with gaze positions in frame
+pixels and return the blurred grid; accumulate() adds a weighted grid into a running buffer.
+"""
+class HistogramKernel:
+    def __init__(self, frame_size, grid, sigma=5.0):
+        self.frame_size = frame_size
+        self.grid = grid
+        self.sigma = sigma
 
-        if world_index not in surface_df['world_index'].values:
-            continue
+    def __call__(self, gaze_y, gaze_x):
+        height, width = self.frame_size
+        hist, _, _ = np.histogram2d(gaze_y, gaze_x, bins=self.grid, range=[[0, height], [0, width]], density=True)
+        from scipy.ndimage import gaussian_filter
+        return gaussian_filter(hist, sigma=(self.sigma, self.sigma))
+
+    def accumulate(self, out, gaze_y, gaze_x, weight=1.0):
+        out += weight * self(gaze_y, gaze_x)
+
+"""
+The _reflected_gaussian_profiles function tabulates, for every grid position p on an axis of
+length n, the 1D Gaussian weights that a unit impulse at p spreads over [p - radius, p + radius].
+Weights falling outside the axis are folded back the way scipy's 'reflect' mode extends the input.
+"""
+def _reflected_gaussian_profiles(n, sigma, truncate=4.0):
+    radius = int(truncate * sigma + 0.5)
+    taps = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * taps ** 2 / sigma ** 2)
+    kernel /= kernel.sum()
+
+    position = np.arange(n)[:, None]
+    output = position + taps[None, :]
+    inside = (output >= 0) & (output < n)
+    profiles = np.zeros((n, 2 * radius + 1))
+
+    # Mirror images of p under half-sample reflection repeat with period 2n
+    periods = radius // (2 * n) + 2
+    for m in range(-periods, periods + 1):
+        for image in (position + 2 * n * m, -1 - position + 2 * n * m):
+            distance = output - image
+            hit = inside & (np.abs(distance) <= radius)
+            profiles[hit] += kernel[distance[hit] + radius]
+
+    return profiles, radius
+
+"""
+SplatKernel produces the same grid as HistogramKernel by adding a precomputed separable Gaussian
+stamp at the bin of every gaze point, instead of blurring the whole grid. Its cost depends on the
+number of gaze points rather than the grid size. accumulate() keeps the bins and stamps in scratch
+arrays that only grow when a frame has more points than any before, so in steady state it
+allocates nothing.
+"""
+class SplatKernel:
+    def __init__(self, frame_size, grid, sigma=5.0):
+        self.frame_size = frame_size
+        self.grid = grid
+        self.sigma = sigma
+
+        height, width = frame_size
+        self.row_edges = np.linspace(0, height, grid[0] + 1)
+        self.col_edges = np.linspace(0, width, grid[1] + 1)
+        self.row_widths = np.diff(self.row_edges)
+        self.col_widths = np.diff(self.col_edges)
+        self.row_profiles, self.radius = _reflected_gaussian_profiles(grid[0], sigma)
+        self.col_profiles, _ = _reflected_gaussian_profiles(grid[1], sigma)
+
+        # Binning runs per point, where bisect on lists beats NumPy's per-call overhead
+        self.row_edge_list = self.row_edges.tolist()
+        self.col_edge_list = self.col_edges.tolist()
+        # Flat, so every clipped stamp shape can be a contiguous view of it
+        self.stamp = np.empty((2 * self.radius + 1) ** 2)
+        self.rows = np.empty(0, dtype=np.intp)
+        self.cols = np.empty(0, dtype=np.intp)
+
+    @staticmethod
+    def _bin(value, edges):
+        # Same binning rule as np.histogram2d: right edge inclusive, outside and NaN points out of range
+        if value == edges[-1]:
+            return len(edges) - 2
+        return bisect.bisect_right(edges, value) - 1
+
+    def __call__(self, gaze_y, gaze_x):
+        out = np.zeros(self.grid)
+        self.accumulate(out, gaze_y, gaze_x)
+        return out
+
+    def accumulate(self, out, gaze_y, gaze_x, weight=1.0):
+        if len(gaze_y) > len(self.rows):
+            self.rows = np.empty(max(len(gaze_y), 2 * len(self.rows)), dtype=np.intp)
+            self.cols = np.empty_like(self.rows)
+
+        in_range = 0
+        for y, x in zip(gaze_y, gaze_x):
+            row = self._bin(float(y), self.row_edge_list)
+            col = self._bin(float(x), self.col_edge_list)
+            if 0 <= row < self.grid[0] and 0 <= col < self.grid[1]:
+                self.rows[in_range] = row
+                self.cols[in_range] = col
+                in_range += 1
+
+        radius = self.radius
+        for k in range(in_range):
+            row, col = int(self.rows[k]), int(self.cols[k])
+            # density=True: each point counts 1 / (in-range points * bin area)
+            w = weight / (in_range * self.row_widths[row] * self.col_widths[col])
+            top, bottom = max(row - radius, 0), min(row + radius + 1, self.grid[0])
+            left, right = max(col - radius, 0), min(col + radius + 1, self.grid[1])
+            stamp = self.stamp[:(bottom - top) * (right - left)].reshape(bottom - top, right - left)
+            np.matmul(self.row_profiles[row, top - row + radius:bottom - row + radius, None],
+                      self.col_profiles[None, col, left - col + radius:right - col + radius], out=stamp)
+            # NumPy buffers in-place arithmetic on 2D strided windows; OpenCV adds into them directly
+            window = out[top:bottom, left:right]
+            cv2.scaleAdd(stamp, w, window, dst=window)
+
+HEATMAP_KERNELS = {
+    'histogram': HistogramKernel,
+    'splat': SplatKernel,
+}
+
+"""
+PooledKernel applies a kernel to the gaze of several subjects on the same frame. Gaze positions
+are passed as one array per subject, and every subject is density-normalised on its own, so each
+one contributes the same mass whatever its sampling rate or number of samples on the frame.
+"""
+class PooledKernel:
+    def __init__(self, kernel):
+        self.kernel = kernel
+        self.grid = kernel.grid
+
+    def __call__(self, gaze_y, gaze_x):
+        out = np.zeros(self.grid)
+        self.accumulate(out, gaze_y, gaze_x)
+        return out
+
+    def accumulate(self, out, gaze_y, gaze_x, weight=1.0):
+        for subject_y, subject_x in zip(gaze_y, gaze_x):
+            self.kernel.accumulate(out, subject_y, subject_x, weight)
+
+"""
+The heatmap accumulators turn the gaze samples of consecutive frames into the grid shown on
+each frame. update() is called once per frame, in order, with the frame's gaze positions in
+pixels (or None) and returns the grid to draw, or None when there is nothing to show. The
+grid holds the heatmap multiplied by the accumulator's `gain`, which is 1 unless noted.
+`warmup` is the number of preceding frames that must be replayed to reproduce the state at an
+arbitrary frame. FrameHeatmap only uses the current frame's samples; with reuse_buffer it clears and refills one
+grid instead of allocating a new one per frame. That makes a frame allocation-free with SplatKernel only;
+HistogramKernel still builds a new histogram and blurred grid per frame.
+"""
+class FrameHeatmap:
+    def __init__(self, kernel, reuse_buffer=False):
+        self.kernel = kernel
+        self.buffer = np.zeros(kernel.grid) if reuse_buffer else None
+        self.gain = 1.0
+        self.warmup = 0
+
+    def update(self, world_index, samples):
+        if samples is None:
+            return None
+        gaze_y, gaze_x = samples
+        if self.buffer is None:
+            return self.kernel(gaze_y, gaze_x)
+
+        self.buffer.fill(0)
+        self.kernel.accumulate(self.buffer, gaze_y, gaze_x)
+        return self.buffer
 
-        gaze_on_frame = surface_df[surface_df.world_index == world_index]
-        gaze_x = gaze_on_frame['norm_pos_x'].values
-        gaze_y = 1 - gaze_on_frame['norm_pos_y'].values  # Adjust for OpenCV's coordinate system
+"""
+DecayingHeatmap keeps a running buffer in which a frame's contribution fades by `decay` per
+frame. Instead of scaling the whole buffer every frame, new samples are added with a growing
+gain, so an update only touches the new samples' stamps; the buffer is rescaled only when the
+gain gets large. The colour map normalises per frame, so the common scale does not matter for
+the video; stored grids are divided by the gain.
+"""
+class DecayingHeatmap:
+    MIN_MASS = 1e-3
+    MAX_GAIN = 1e100
+
+    def __init__(self, kernel, decay):
+        self.kernel = kernel
+        self.decay = decay
+        self.buffer = np.zeros(kernel.grid)
+        self.gain = 1.0
+        self.mass = 0.0
+        self.last_index = None
+        # Frames older than this have faded below 1e-12 of a fresh frame
+        self.warmup = int(np.ceil(np.log(1e-12) / np.log(decay))) if 0 < decay < 1 else 0
+
+    def update(self, world_index, samples):
+        if self.last_index is not None and self.mass > 0:
+            factor = self.decay ** (world_index - self.last_index)
+            self.mass *= factor
+            if self.mass < self.MIN_MASS:
+                # Everything has faded, start over from an empty buffer
+                self.buffer.fill(0)
+                self.gain = 1.0
+                self.mass = 0.0
+            else:
+                self.gain /= factor
+                if self.gain > self.MAX_GAIN:
+                    self.buffer /= self.gain
+                    self.gain = 1.0
+        self.last_index = world_index
+
+        if samples is not None:
+            gaze_y, gaze_x = samples
+            self.kernel.accumulate(self.buffer, gaze_y, gaze_x, self.gain)
+            self.mass += 1.0
+
+        return self.buffer if self.mass > 0 else None
+
+"""
+SlidingWindowHeatmap sums the heatmaps of the last `window` frames. The samples of each frame
+are kept until they leave the window and are then subtracted again, so an update costs the
+samples entering and leaving rather than the window length.
+"""
+class SlidingWindowHeatmap:
+    def __init__(self, kernel, window):
+        self.kernel = kernel
+        self.window = window
+        self.buffer = np.zeros(kernel.grid)
+        self.gain = 1.0
+        self.frames = collections.deque()
+        self.warmup = window - 1
+
+    def update(self, world_index, samples):
+        while self.frames and self.frames[0][0] <= world_index - self.window:
+            _, gaze_y, gaze_x = self.frames.popleft()
+            self.kernel.accumulate(self.buffer, gaze_y, gaze_x, -1.0)
+
+        if samples is not None:
+            gaze_y, gaze_x = samples
+            self.kernel.accumulate(self.buffer, gaze_y, gaze_x, 1.0)
+            self.frames.append((world_index, gaze_y, gaze_x))
+
+        if not self.frames:
+            # Drop the rounding residue left by the subtractions
+            self.buffer.fill(0)
+            return None
+        return self.buffer
+
+"""
+OverlaySink is the base for every per-frame overlay written to its own video. render_overlays
+decodes each world frame once and passes it to all sinks; overlay() returns the image to
+write for that frame, or None to leave the frame out of the sink's video. Sinks must not
+modify the frame they are given, since the other sinks see the same array. seek() is called
+before the first overlay() when rendering starts part way into the video.
+
+When open() gets a buffer_count above 0 the sink works allocation-free: every intermediate is
+allocated once and written in place, and output images come from a ring of buffer_count frames,
+so an image must be written before the sink has produced buffer_count more. A sink without an
+output_path writes no video. close() finishes all outputs of a completed render; after a failed
+one, release() only frees the video writer.
+"""
+class OverlaySink:
+    name = "Overlay"
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.video_writer = None
+        self.width = None
+        self.height = None
+        self.frames_written = 0
+        self.output_buffers = []
+        self.next_output = 0
+
+    def open(self, width, height, frame_rate, buffer_count=0):
+        self.width = width
+        self.height = height
+        self.frames_written = 0
+        self.output_buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(buffer_count)]
+        self.next_output = 0
+        if self.output_path is not None:
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            self.video_writer = cv2.VideoWriter(self.output_path, fourcc, frame_rate, (width, height))
+
+    def output_buffer(self):
+        """Return the next preallocated output image, or None when buffers are not reused."""
+        if not self.output_buffers:
+            return None
+        buffer = self.output_buffers[self.next_output]
+        self.next_output = (self.next_output + 1) % len(self.output_buffers)
+        return buffer
+
+    def seek(self, frame_idx):
+        pass
+
+    def overlay(self, frame_idx, frame):
+        raise NotImplementedError
+
+    def write(self, image):
+        self.video_writer.write(image)
+        self.frames_written += 1
+
+    def release(self):
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+
+    def close(self):
+        self.release()
+
+"""
+HeatmapSink blends a gaze heatmap over every frame that has gaze samples. With a grid_store
+(a heatmap_store.HeatmapStoreWriter) the heatmap grid of every such frame is also saved, and
+with output_path None only the grids are written.
+"""
+class HeatmapSink(OverlaySink):
+    name = "Heatmap"
+
+    def __init__(self, output_path, gaze_index, kernel='splat', grid_scale=2, sigma=5.0, decay=None, window=None,
+                 grid_store=None):
+        super().__init__(output_path)
+        self.grid_store = grid_store
+        self.gaze_index = gaze_index
+        self.offset = gaze_index.first_index
+        self.kernel_name = kernel
+        self.grid_scale = grid_scale
+        self.sigma = sigma
+        self.decay = decay
+        self.window = window
+        self.kernel = None
+        self.accumulator = None
+        self.normalized = None
+        self.heatmap_u8 = None
+        self.heatmap_colored = None
+        self.heatmap_resized = None
+
+    def open(self, width, height, frame_rate, buffer_count=0):
+        super().open(width, height, frame_rate, buffer_count)
+        grid = (height // self.grid_scale, width // self.grid_scale)
+        self.kernel = self.make_kernel((height, width), grid)
+
+        if self.decay is not None:
+            self.accumulator = DecayingHeatmap(self.kernel, self.decay)
+        elif self.window is not None:
+            self.accumulator = SlidingWindowHeatmap(self.kernel, self.window)
+        else:
+            self.accumulator = FrameHeatmap(self.kernel, reuse_buffer=buffer_count > 0)
+
+        if self.grid_store is not None:
+            self.grid_store.open(grid, (height, width))
+
+        if buffer_count:
+            self.normalized = np.empty(grid)
+            self.heatmap_u8 = np.empty(grid, dtype=np.uint8)
+            self.heatmap_colored = np.empty(grid + (3,), dtype=np.uint8)
+            self.heatmap_resized = np.empty((height, width, 3), dtype=np.uint8)
+
+    def make_kernel(self, frame_size, grid):
+        return HEATMAP_KERNELS[self.kernel_name](frame_size, grid, self.sigma)
+
+    def gaze_pixels(self, world_index):
+        """Return the (y, x) pixel positions of the gaze samples on a frame, or None."""
+        return self.subject_pixels(self.gaze_index, world_index)
+
+    def subject_pixels(self, gaze_index, world_index):
+        gaze_on_frame = gaze_index.samples(world_index)
+        if gaze_on_frame is None:
+            return None
+
+        gaze_x = gaze_on_frame[0]
+        gaze_y = 1 - gaze_on_frame[1]  # Adjust for OpenCV's coordinate system
+        return gaze_y * self.height, gaze_x * self.width
+
+    def seek(self, frame_idx):
+        # Trails only depend on gaze data, so replaying them needs no decoding
+        for warm_idx in range(max(frame_idx - self.accumulator.warmup, 0), frame_idx):
+            world_index = warm_idx + self.offset
+            self.accumulator.update(world_index, self.gaze_pixels(world_index))
+
+    def overlay(self, frame_idx, frame):
+        world_index = frame_idx + self.offset
+        height, width = self.height, self.width
 
         # Generate heatmap
-        hist, _, _ = np.histogram2d(gaze_y * height, gaze_x * width, bins=grid, range=[[0, height], [0, width]], density=True)
-        heatmap = gaussian_filter(hist, sigma=(5, 5))
+        heatmap = self.accumulator.update(world_index, self.gaze_pixels(world_index))
+        if heatmap is None:
+            return None
+        if self.grid_store is not None:
+            self.grid_store.append(frame_idx, heatmap, self.accumulator.gain)
+            if self.output_path is None:
+                return None
+
+        if self.output_buffers:
+            # Same steps as below, written into the buffers allocated by open()
+            cv2.normalize(heatmap, self.normalized, 0, 255, cv2.NORM_MINMAX)
+            np.copyto(self.heatmap_u8, self.normalized, casting='unsafe')
+            cv2.applyColorMap(self.heatmap_u8, cv2.COLORMAP_JET, self.heatmap_colored)
+            cv2.resize(self.heatmap_colored, (width, height), self.heatmap_resized)
+            return cv2.addWeighted(frame, 0.7, self.heatmap_resized, 0.3, 0, self.output_buffer())
 
         # Normalize and color the heatmap
         heatmap = cv2.normalize(heatmap, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
@@ -77,72 +528,527 @@ def generate_heatmap_video(video_path, gaze_positions, output_path, frame_rate):
         heatmap_resized = cv2.resize(heatmap_colored, (width, height))
 
         # Blend the heatmap with the original frame
-        overlay = cv2.addWeighted(reference_frame, 0.7, heatmap_resized, 0.3, 0)
-        video_writer.write(overlay)
+        return cv2.addWeighted(frame, 0.7, heatmap_resized, 0.3, 0)
+
+    def close(self):
+        super().close()
+        if self.grid_store is not None:
+            self.grid_store.close()
+
 
-    video_writer.release()
-    print(f"Heatmap video successfully written to {output_path}")
 """
-Generate fixation video by plotting fixation points.
+AggregateHeatmapSink blends one population heatmap of several subjects' gaze over a single
+decode of the stimulus video they all watched. Frame 0 of the video is matched to the first
+world_index of each subject. Every frame only reads the subjects' gaze slices for that frame,
+which stay memory-mapped in the export cache, so memory does not grow with the gaze data, and
+the kernel weighs each subject equally (see PooledKernel). Decay and window trails apply to the
+pooled heatmap.
 """
+class AggregateHeatmapSink(HeatmapSink):
+    name = "Aggregate heatmap"
 
+    def __init__(self, output_path, gaze_indexes, **kernel_options):
+        super().__init__(output_path, gaze_indexes[0], **kernel_options)
+        self.gaze_indexes = gaze_indexes
+        # Frame indices are mapped to each subject's world_index in gaze_pixels
+        self.offset = 0
 
-def generate_fixation_video(video_path, fixation_data, output_path, frame_rate):
-    fixation_df = pd.read_csv(fixation_data)
+    def make_kernel(self, frame_size, grid):
+        return PooledKernel(super().make_kernel(frame_size, grid))
 
-    # Ensure required columns are present
-    required_cols = {'start_frame_index', 'end_frame_index', 'norm_pos_x', 'norm_pos_y', 'id'}
-    if not required_cols.issubset(fixation_df.columns):
-        print("Error: Fixation CSV file does not contain required columns.")
-        return
+    def gaze_pixels(self, frame_idx):
+        """Return per-subject lists of (y, x) gaze pixel positions on a frame, or None if no subject has gaze."""
+        gaze_y, gaze_x = [], []
+        for gaze_index in self.gaze_indexes:
+            pixels = self.subject_pixels(gaze_index, frame_idx + gaze_index.first_index)
+            if pixels is not None:
+                gaze_y.append(pixels[0])
+                gaze_x.append(pixels[1])
+        return (gaze_y, gaze_x) if gaze_y else None
 
-    reference_frames = load_reference_video(video_path)
-    if not reference_frames:
-        print("Error: No frames loaded from video.")
-        return
 
-    height, width, _ = reference_frames[0].shape
+"""
+ActiveFixationTracker sweeps a frame cursor over the fixation intervals. Fixations are
+activated from a start-sorted order and retired through a heap keyed on their end frame,
+so each step only touches the fixations entering or leaving the active set.
+"""
+class ActiveFixationTracker:
+    def __init__(self, start_frame_index, end_frame_index):
+        self.start_frame_index = np.asarray(start_frame_index)
+        self.end_frame_index = np.asarray(end_frame_index)
+        self.order = np.argsort(self.start_frame_index, kind='stable')
+        self.cursor = 0
+        self.ending = []
+        self.active = set()
+
+    def advance(self, frame_index):
+        """Move the cursor forward to frame_index and return the active rows in table order."""
+        while self.cursor < len(self.order):
+            row = self.order[self.cursor]
+            if not self.start_frame_index[row] <= frame_index:
+                break
+            self.cursor += 1
+            if self.end_frame_index[row] >= frame_index:
+                heapq.heappush(self.ending, (self.end_frame_index[row], row))
+                self.active.add(row)
 
-    # Setup video writer
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    video_writer = cv2.VideoWriter(output_path, fourcc, frame_rate, (width, height))
+        while self.ending and self.ending[0][0] < frame_index:
+            _, row = heapq.heappop(self.ending)
+            self.active.discard(row)
 
-    offset = fixation_df['start_frame_index'].min()
+        return sorted(self.active)
 
-    for frame_idx, reference_frame in tqdm(enumerate(reference_frames), total=len(reference_frames)):
-        adjusted_frame_index = frame_idx + offset
+"""
+FixationSink draws the active fixations with their ids on every frame.
+"""
+class FixationSink(OverlaySink):
+    name = "Fixation"
 
-        # Filter fixation data for the current frame
-        current_fixations = fixation_df[
-            (fixation_df['start_frame_index'] <= adjusted_frame_index) &
-            (fixation_df['end_frame_index'] >= adjusted_frame_index)
-        ]
+    def __init__(self, output_path, fixation_df):
+        super().__init__(output_path)
+        self.fixation_df = fixation_df
+        self.tracker = ActiveFixationTracker(fixation_df['start_frame_index'].values,
+                                             fixation_df['end_frame_index'].values)
+        self.offset = fixation_df['start_frame_index'].min()
+        self.fixation_x = None
+        self.fixation_y = None
+        self.fixation_labels = fixation_df['id'].astype(str).tolist()
 
-        # Skip if no fixations for the current frame
-        if current_fixations.empty:
-            video_writer.write(reference_frame)
-            continue
+    def open(self, width, height, frame_rate, buffer_count=0):
+        super().open(width, height, frame_rate, buffer_count)
+
+        # Drawing coordinates are resolved once for the whole table
+        self.fixation_x = (self.fixation_df['norm_pos_x'].values * width).astype(int)
+        self.fixation_y = (self.fixation_df['norm_pos_y'].values * height).astype(int)  # Adjusted for OpenCV's top-left origin
+
+    def overlay(self, frame_idx, frame):
+        adjusted_frame_index = frame_idx + self.offset
 
-        # Plot fixations directly on the frame
-        for _, fixation in current_fixations.iterrows():
-            gaze_x = int(fixation['norm_pos_x'] * width)
-            gaze_y = int(fixation['norm_pos_y'] * height)  # Adjusted for OpenCV's top-left origin
+        # Fixations covering the current frame
+        current_fixations = self.tracker.advance(adjusted_frame_index)
+
+        # Write the frame untouched if no fixations are active
+        if not current_fixations:
+            return frame
+
+        # Plot fixations on a copy, the frame itself is shared with the other sinks
+        output = self.output_buffer()
+        if output is None:
+            frame = frame.copy()
+        else:
+            np.copyto(output, frame)
+            frame = output
+        for row in current_fixations:
+            gaze_x = int(self.fixation_x[row])
+            gaze_y = int(self.fixation_y[row])
 
             # Draw a red circle for fixation
-            cv2.circle(reference_frame, (gaze_x, gaze_y), 10, (0, 0, 255), -1)
+            cv2.circle(frame, (gaze_x, gaze_y), 10, (0, 0, 255), -1)
 
             # Draw fixation ID as text
             cv2.putText(
-                reference_frame, str(fixation['id']),
+                frame, self.fixation_labels[row],
                 (gaze_x + 5, gaze_y - 5),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA
             )
 
-        # Write the modified frame to the video
-        video_writer.write(reference_frame)
+        return frame
+
+
+"""
+The load_heatmap_sink function reads the gaze positions CSV and returns a HeatmapSink,
+or None if the file does not contain the required columns.
+"""
+def load_heatmap_sink(gaze_positions, output_path, **kernel_options):
+    surface_df = export_cache.load_gaze_positions(gaze_positions)
+
+    # Check if required columns exist
+    if not {'world_index', 'norm_pos_x', 'norm_pos_y'}.issubset(surface_df.columns):
+        print("Error: CSV file does not contain required columns.")
+        return None
+
+    return HeatmapSink(output_path, GazeFrameIndex.from_dataframe(surface_df), **kernel_options)
+
+"""
+The load_aggregate_heatmap_sink function reads several subjects' gaze positions CSVs and returns
+an AggregateHeatmapSink, or None if a file does not contain the required columns.
+"""
+def load_aggregate_heatmap_sink(gaze_positions_files, output_path, **kernel_options):
+    gaze_indexes = []
+    for gaze_positions in gaze_positions_files:
+        surface_df = export_cache.load_gaze_positions(gaze_positions)
+        if not {'world_index', 'norm_pos_x', 'norm_pos_y'}.issubset(surface_df.columns):
+            print(f"Error: {gaze_positions} does not contain required columns.")
+            return None
+        gaze_indexes.append(GazeFrameIndex.from_dataframe(surface_df))
+
+    if not gaze_indexes:
+        print("Error: No gaze positions given.")
+        return None
+    return AggregateHeatmapSink(output_path, gaze_indexes, **kernel_options)
+
+"""
+The load_fixation_sink function reads the fixations CSV and returns a FixationSink,
+or None if the file does not contain the required columns.
+"""
+def load_fixation_sink(fixation_data, output_path):
+    fixation_df = export_cache.load_fixations(fixation_data)
+
+    # Ensure required columns are present
+    required_cols = {'start_frame_index', 'end_frame_index', 'norm_pos_x', 'norm_pos_y', 'id'}
+    if not required_cols.issubset(fixation_df.columns):
+        print("Error: Fixation CSV file does not contain required columns.")
+        return None
+
+    return FixationSink(output_path, fixation_df)
+
+"""
+PipelineStats collects the busy time of each stage of a pipelined render. A stage close to 100%
+utilisation is the bottleneck, the others spend the rest of the wall time waiting on queues.
+"""
+class PipelineStats:
+    def __init__(self, stages):
+        self.busy = dict.fromkeys(stages, 0.0)
+        self.wall = 0.0
+
+    def utilisation(self):
+        return {stage: busy / self.wall if self.wall else 0.0 for stage, busy in self.busy.items()}
+
+    def report(self):
+        stages = ', '.join(f"{stage} {share:.0%}" for stage, share in self.utilisation().items())
+        return f"Stage utilisation over {self.wall:.1f}s: {stages}"
+
+_END_OF_STREAM = object()
+
+def _queue_put(stage_queue, item, stop):
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _queue_get(stage_queue, stop):
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END_OF_STREAM
+
+"""
+The render_pipelined function runs decode, overlay and encode as three stages connected by
+bounded queues. Decoding and encoding run in their own threads; OpenCV releases the GIL inside
+both, so they overlap with the overlay compute on the calling thread. The first error raised
+by any stage stops the others and is re-raised here.
+"""
+def render_pipelined(reference_frames, sinks, start=0, total=None, progress=True, queue_size=8):
+    decoded = queue.Queue(maxsize=queue_size)
+    encoded = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    stats = PipelineStats(('decode', 'overlay', 'encode'))
+
+    def decode():
+        try:
+            frames = enumerate(reference_frames, start)
+            while True:
+                began = time.perf_counter()
+                item = next(frames, _END_OF_STREAM)
+                stats.busy['decode'] += time.perf_counter() - began
+                if item is _END_OF_STREAM or not _queue_put(decoded, item, stop):
+                    break
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+        finally:
+            _queue_put(decoded, _END_OF_STREAM, stop)
+
+    def encode():
+        try:
+            while True:
+                images = _queue_get(encoded, stop)
+                if images is _END_OF_STREAM:
+                    break
+                began = time.perf_counter()
+                for sink, image in images:
+                    sink.write(image)
+                stats.busy['encode'] += time.perf_counter() - began
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+
+    threads = [threading.Thread(target=decode, daemon=True), threading.Thread(target=encode, daemon=True)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    try:
+        with tqdm(total=total, disable=not progress) as progress_bar:
+            while True:
+                item = _queue_get(decoded, stop)
+                if item is _END_OF_STREAM:
+                    break
+
+                began = time.perf_counter()
+                frame_idx, reference_frame = item
+                images = []
+                for sink in sinks:
+                    image = sink.overlay(frame_idx, reference_frame)
+                    if image is not None:
+                        images.append((sink, image))
+                stats.busy['overlay'] += time.perf_counter() - began
+
+                if not _queue_put(encoded, images, stop):
+                    break
+                progress_bar.update()
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        _queue_put(encoded, _END_OF_STREAM, stop)
+        for thread in threads:
+            thread.join()
+        stats.wall = time.perf_counter() - started
+
+    if errors:
+        raise errors[0]
+    return stats
 
-    video_writer.release()
-    print(f"Fixation video successfully written to {output_path}")
+"""
+The render_frame_range function decodes frames [start, stop) of the video once and feeds every
+frame to all sinks, optionally through the threaded pipeline. The frame rate defaults to the
+one stored in the container. It returns False if no frame could be decoded. If rendering fails
+the sinks' video writers are still released.
+"""
+def render_frame_range(video_path, sinks, frame_rate=None, scale=1.0, start=0, stop=None, progress=True,
+                       pipeline=False, queue_size=8, reuse_buffers=False):
+    cap = cv2.VideoCapture(video_path)
+    if frame_rate is None:
+        frame_rate = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    # Frames that can be in flight at once: queued, held by each stage, and the one being filled
+    in_flight = 2 * queue_size + 4 if pipeline else 1
+    decoder = iter_capture_frames(cap, scale, in_flight if reuse_buffers else 0)
+    reference_frames = decoder if stop is None else itertools.islice(decoder, stop - start)
+    first_frame = next(reference_frames, None)
+    if first_frame is None:
+        decoder.close()
+        print("Error: No frames loaded from video.")
+        return False
+
+    height, width, _ = first_frame.shape
+    reference_frames = itertools.chain([first_frame], reference_frames)
+
+    total = (stop if stop is not None else frame_count) - start
+    completed = False
+    try:
+        for sink in sinks:
+            sink.open(width, height, frame_rate, in_flight if reuse_buffers else 0)
+            sink.seek(start)
+
+        if pipeline:
+            stats = render_pipelined(reference_frames, sinks, start, total, progress, queue_size)
+            if progress:
+                print(stats.report())
+        else:
+            for frame_idx, reference_frame in tqdm(enumerate(reference_frames, start), total=total, disable=not progress):
+                for sink in sinks:
+                    image = sink.overlay(frame_idx, reference_frame)
+                    if image is not None:
+                        sink.write(image)
+        completed = True
+    finally:
+        decoder.close()
+        for sink in sinks:
+            if completed:
+                sink.close()
+            else:
+                sink.release()
+    return True
+
+"""
+The concat_videos function joins video parts with ffmpeg's concat demuxer without re-encoding.
+"""
+def concat_videos(part_paths, output_path):
+    list_path = output_path + '.parts.txt'
+    with open(list_path, 'w') as list_file:
+        for part_path in part_paths:
+            escaped = os.path.abspath(part_path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+
+    try:
+        subprocess.run(['ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+                        '-c', 'copy', output_path], check=True)
+    finally:
+        os.remove(list_path)
+
+def _render_chunk(video_path, sinks, part_paths, frame_rate, scale, start, stop, pipeline, reuse_buffers):
+    for sink, part_path in zip(sinks, part_paths):
+        sink.output_path = part_path
+    if not render_frame_range(video_path, sinks, frame_rate, scale, start, stop, progress=False,
+                              pipeline=pipeline, reuse_buffers=reuse_buffers):
+        return None
+    return [sink.frames_written for sink in sinks]
+
+"""
+The render_overlays_parallel function splits the frame range into one chunk per worker and
+renders each chunk in its own process, seeking straight to the chunk start. Each sink's parts
+are then joined into its output video with a stream copy. Chunks that decoded no frames (when the
+container over-reports its frame count) have no parts and are skipped.
+"""
+def render_overlays_parallel(video_path, sinks, frame_rate=None, scale=1.0, workers=2, pipeline=False,
+                             reuse_buffers=False):
+    if frame_rate is None:
+        frame_rate = get_video_frame_rate(video_path)
+    frame_count = get_video_frame_count(video_path)
+
+    if frame_count <= 0:
+        print("Error: Could not read the frame count of the video.")
+        return
+
+    chunk_size = -(-frame_count // workers)
+    starts = list(range(0, frame_count, chunk_size))
+    # The last chunk reads to the end, in case the container under-reports its frame count
+    stops = starts[1:] + [None]
+
+    part_dir = tempfile.mkdtemp(prefix='overlay_parts_', dir=os.path.dirname(os.path.abspath(sinks[0].output_path)))
+    try:
+        part_paths = [
+            [os.path.join(part_dir, f"{chunk:04d}_{i}.mp4") for i in range(len(sinks))]
+            for chunk in range(len(starts))
+        ]
+        frames_written = [None] * len(starts)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_render_chunk, video_path, sinks, part_paths[chunk], frame_rate, scale, start, stop,
+                            pipeline, reuse_buffers): chunk
+                for chunk, (start, stop) in enumerate(zip(starts, stops))
+            }
+            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+                frames_written[futures[future]] = future.result()
+
+        decoded = [chunk for chunk in range(len(starts)) if frames_written[chunk] is not None]
+        if not decoded:
+            raise RuntimeError(f"No frames could be decoded from {video_path}")
+
+        for i, sink in enumerate(sinks):
+            parts = [part_paths[chunk][i] for chunk in decoded if frames_written[chunk][i] > 0]
+            if parts:
+                concat_videos(parts, sink.output_path)
+            else:
+                # The sink drew on no frame; its (empty) part from a decoded chunk is the whole video
+                shutil.copy(part_paths[decoded[0]][i], sink.output_path)
+            print(f"{sink.name} video successfully written to {sink.output_path}")
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+"""
+The render_overlays function renders all sinks from a single decode of the video, or from
+`workers` parallel chunk decodes when workers is above 1.
+"""
+def render_overlays(video_path, sinks, frame_rate=None, scale=1.0, workers=1, pipeline=False, reuse_buffers=False,
+                    progress=True):
+    grid_stores = [sink.grid_store for sink in sinks if getattr(sink, 'grid_store', None) is not None]
+    if workers > 1:
+        if grid_stores:
+            print("Error: Heatmap grids can only be written with a single worker.")
+            return
+        render_overlays_parallel(video_path, sinks, frame_rate, scale, workers, pipeline, reuse_buffers)
+        return
+
+    if render_frame_range(video_path, sinks, frame_rate, scale, progress=progress, pipeline=pipeline,
+                          reuse_buffers=reuse_buffers):
+        for sink in sinks:
+            if sink.output_path is not None:
+                print(f"{sink.name} video successfully written to {sink.output_path}")
+        for grid_store in grid_stores:
+            print(f"Heatmap grids successfully written to {grid_store.path}")
+
+"""
+Generate heatmap video from gaze data.
+"""
+def generate_heatmap_video(video_path, gaze_positions, output_path, frame_rate, scale=1.0, workers=1, pipeline=False,
+                           **kernel_options):
+    sink = load_heatmap_sink(gaze_positions, output_path, **kernel_options)
+    if sink is None:
+        return
+
+    render_overlays(video_path, [sink], frame_rate, scale, workers, pipeline)
+
+"""
+Generate fixation video by plotting fixation points.
+"""
+def generate_fixation_video(video_path, fixation_data, output_path, frame_rate, scale=1.0, workers=1, pipeline=False):
+    sink = load_fixation_sink(fixation_data, output_path)
+    if sink is None:
+        return
+
+    render_overlays(video_path, [sink], frame_rate, scale, workers, pipeline)
+
+"""
+The add_heatmap_arguments function adds the heatmap kernel and trail options to a parser, and
+heatmap_options turns the parsed arguments into keyword arguments for load_heatmap_sink. Trails
+are checked when parsing: with a decay outside (0, 1) or an empty window the warmup replayed by
+chunked renders would not reproduce the serial render.
+"""
+def _decay_factor(value):
+    try:
+        decay = float(value)
+    except ValueError:
+        decay = None
+    if decay is None or not 0 < decay < 1:
+        raise argparse.ArgumentTypeError(f"decay must be a number between 0 and 1 (exclusive), got {value}")
+    return decay
+
+def _window_length(value):
+    try:
+        window = int(value)
+    except ValueError:
+        window = None
+    if window is None or window < 1:
+        raise argparse.ArgumentTypeError(f"window must be a whole number of at least 1 frame, got {value}")
+    return window
+
+def add_heatmap_arguments(parser):
+    parser.add_argument('--heatmap-kernel', choices=sorted(HEATMAP_KERNELS), default='splat',
+                        help='Heatmap implementation: Gaussian stamps per gaze point, or histogram2d + gaussian_filter')
+    parser.add_argument('--grid-scale', type=int, default=2,
+                        help='Heatmap grid is the frame size divided by this factor')
+    parser.add_argument('--sigma', type=float, default=5.0, help='Gaussian sigma in grid cells')
+    trail = parser.add_mutually_exclusive_group()
+    trail.add_argument('--decay', type=_decay_factor,
+                       help='Accumulate gaze over time, fading each frame by this factor (e.g. 0.9)')
+    trail.add_argument('--window', type=_window_length,
+                       help='Accumulate gaze over a sliding window of this many frames')
+
+def heatmap_options(args):
+    return dict(kernel=args.heatmap_kernel, grid_scale=args.grid_scale, sigma=args.sigma,
+                decay=args.decay, window=args.window)
+
+"""
+The add_render_arguments function adds the options of render_overlays shared by the rendering tools:
+--scale always, --workers when the tool renders a single video in chunks, and the --pipeline and
+--reuse-buffers render modes unless the tool chooses modes itself.
+"""
+def add_render_arguments(parser, workers=False, modes=True):
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Downscale factor applied to every frame before rendering (e.g. 0.5)')
+    if workers:
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Render this many chunks of the video in parallel processes '
+                                 '(needs ffmpeg to join them)')
+    if modes:
+        parser.add_argument('--pipeline', action='store_true',
+                            help='Overlap decoding, overlay and encoding in separate threads and report '
+                                 'stage utilisation')
+        parser.add_argument('--reuse-buffers', action='store_true',
+                            help='Allocate frame and heatmap buffers once per video and write them in place')
 
 def main():
     parser = argparse.ArgumentParser(description='Generate heatmap and fixation videos.')
@@ -151,11 +1057,35 @@ def main():
     parser.add_argument('fixation_data', help='Path to the fixation data CSV file')
     parser.add_argument('heatmap_video', help='Path to the output heatmap video')
     parser.add_argument('fixation_video', help='Path to the output fixation video')
+    add_render_arguments(parser, workers=True)
+    add_heatmap_arguments(parser)
+    parser.add_argument('--heatmap-grids', help='Also write the per-frame heatmap grids to this store directory')
+    parser.add_argument('--grid-dtype', choices=heatmap_store.GRID_DTYPES, default='uint8',
+                        help='Storage type of the heatmap grids, each scaled to its maximum')
+    parser.add_argument('--grid-chunk-frames', type=int, default=256, help='Heatmap grids per chunk file')
+    parser.add_argument('--uncompressed-grids', action='store_true',
+                        help='Write uncompressed chunks that can be memory-mapped')
+    parser.add_argument('--no-heatmap-video', action='store_true',
+                        help='Only write the heatmap grids, not the heatmap video')
     args = parser.parse_args()
 
-    frame_rate = get_video_frame_rate(args.video_path)
-    generate_heatmap_video(args.video_path, args.gaze_positions, args.heatmap_video, frame_rate)
-    generate_fixation_video(args.video_path, args.fixation_data, args.fixation_video, frame_rate)
+    grid_store = None
+    if args.heatmap_grids:
+        grid_store = heatmap_store.HeatmapStoreWriter(args.heatmap_grids, args.grid_dtype, args.grid_chunk_frames,
+                                                      compress=not args.uncompressed_grids)
+    elif args.no_heatmap_video:
+        parser.error('--no-heatmap-video needs --heatmap-grids')
+    heatmap_video = None if args.no_heatmap_video else args.heatmap_video
+
+    # Both videos are rendered from a single decode of the world video
+    sinks = [
+        load_heatmap_sink(args.gaze_positions, heatmap_video, grid_store=grid_store, **heatmap_options(args)),
+        load_fixation_sink(args.fixation_data, args.fixation_video),
+    ]
+    sinks = [sink for sink in sinks if sink is not None]
+    if sinks:
+        render_overlays(args.video_path, sinks, scale=args.scale, workers=args.workers, pipeline=args.pipeline,
+                        reuse_buffers=args.reuse_buffers)
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,10 @@
 import torch
 import torch.nn as nn
-from transformers import AutoModel
 
 class CombinedModel(nn.Module):
     def __init__(self, saved_classifier):
         super(CombinedModel, self).__init__()
+        from transformers import AutoModel
         self.dino = AutoModel.from_pretrained('facebook/dinov2-base')
         self.classifier = saved_classifier
 
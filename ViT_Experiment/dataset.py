@@ -1,11 +1,11 @@
 import torch
-from transformers import AutoImageProcessor, AutoModel
 from PIL import Image
 from torch.utils.data import Dataset
 
 
 class ViolenceDataset(Dataset):
     def __init__(self, image_paths, transform=None):
+        from transformers import AutoImageProcessor, AutoModel
         self.image_paths = image_paths
         self.transform = transform
         self.processor = AutoImageProcessor.from_pretrained('facebook/dinov2-base')
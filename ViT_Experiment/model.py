@@ -1,7 +1,3 @@
-import torchvision.models as models
-import torch.nn as nn
-from transformers import ViTForImageClassification
-
 import torch.nn as nn
 
 
@@ -36,6 +32,7 @@ class CNNClassifier(nn.Module):
 class ResNetClassifier(nn.Module):
     def __init__(self, input_dim):
         super(ResNetClassifier, self).__init__()
+        import torchvision.models as models
         self.resnet = models.resnet50(pretrained=True)
         num_ftrs = self.resnet.fc.in_features
         self.resnet.fc = nn.Linear(num_ftrs, 2)
@@ -46,6 +43,7 @@ class ResNetClassifier(nn.Module):
 class ViTClassifier(nn.Module):
     def __init__(self, input_dim):
         super(ViTClassifier, self).__init__()
+        from transformers import ViTForImageClassification
         self.vit = ViTForImageClassification.from_pretrained('google/vit-base-patch16-224')
         self.vit.classifier = nn.Linear(self.vit.config.hidden_size, 2)
 
@@ -0,0 +1,25 @@
+import argparse
+
+import Temporal_Heatpmap_DP as renderer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render one population heatmap video from several subjects watching '
+                                                 'the same stimulus video.')
+    parser.add_argument('video_path', help='Path to the stimulus video')
+    parser.add_argument('output_path', help='Path to the output heatmap video')
+    parser.add_argument('gaze_positions', nargs='+', help="Each subject's gaze positions CSV file")
+    renderer.add_render_arguments(parser, workers=True)
+    renderer.add_heatmap_arguments(parser)
+    args = parser.parse_args()
+
+    sink = renderer.load_aggregate_heatmap_sink(args.gaze_positions, args.output_path,
+                                                **renderer.heatmap_options(args))
+    if sink is not None:
+        print(f"Aggregating the gaze of {len(sink.gaze_indexes)} subjects")
+        renderer.render_overlays(args.video_path, [sink], scale=args.scale, workers=args.workers,
+                                 pipeline=args.pipeline, reuse_buffers=args.reuse_buffers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import export_cache
+import pupil_batch
+
+"""
+AOI files are JSON lists of areas of interest. Each AOI has keyframes with a polygon (a list of
+[x, y] vertices) or a box ([x0, y0, x1, y1]) in Pupil's normalised coordinates (origin bottom
+left, as norm_pos). Frames are world frame numbers, the units of world_index and
+start_frame_index in the exports:
+
+    [{"name": "fight", "end_frame": 300,
+      "keyframes": [{"frame": 120, "box": [0.2, 0.3, 0.6, 0.8]},
+                    {"frame": 240, "polygon": [[0.3, 0.3], [0.7, 0.3], [0.7, 0.9], [0.3, 0.9]]}]}]
+
+An AOI is active from its first keyframe to end_frame (default: its last keyframe). Between
+keyframes the vertices are interpolated linearly when both keyframes have the same number of
+vertices ("interpolate": false holds each keyframe instead).
+"""
+
+
+def _keyframe_vertices(keyframe):
+    if 'box' in keyframe:
+        x0, y0, x1, y1 = keyframe['box']
+        return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=float)
+    return np.asarray(keyframe['polygon'], dtype=float)
+
+
+class Aoi:
+    """An area of interest with one polygon per frame of its active range, padded to a common vertex count."""
+
+    def __init__(self, name, start_frame, polygons):
+        self.name = name
+        self.start_frame = start_frame
+        self.polygons = polygons
+
+    @property
+    def end_frame(self):
+        return self.start_frame + len(self.polygons) - 1
+
+    @classmethod
+    def from_keyframes(cls, name, keyframes, end_frame=None, interpolate=True):
+        if not keyframes:
+            raise ValueError(f"AOI {name} has no keyframes")
+        keyframes = sorted(keyframes, key=lambda keyframe: keyframe['frame'])
+        frames = [keyframe['frame'] for keyframe in keyframes]
+        if len(set(frames)) < len(frames):
+            raise ValueError(f"AOI {name} has several keyframes on the same frame")
+        vertices = [_keyframe_vertices(keyframe) for keyframe in keyframes]
+        start_frame = frames[0]
+        end_frame = frames[-1] if end_frame is None else end_frame
+        if end_frame < start_frame:
+            raise ValueError(f"AOI {name} ends on frame {end_frame}, before its first keyframe {start_frame}")
+
+        # Repeating the last vertex adds zero-length edges, which never count as crossings
+        vertex_count = max(len(polygon) for polygon in vertices)
+        padded = [np.vstack([polygon, np.repeat(polygon[-1:], vertex_count - len(polygon), axis=0)])
+                  for polygon in vertices]
+
+        polygons = np.empty((end_frame - start_frame + 1, vertex_count, 2))
+        bounds = frames[1:] + [end_frame + 1]
+        for k, (frame, next_frame) in enumerate(zip(frames, bounds)):
+            span = np.arange(frame, min(next_frame, end_frame + 1)) - start_frame
+            if interpolate and k + 1 < len(frames) and len(vertices[k]) == len(vertices[k + 1]):
+                t = ((span + start_frame - frame) / (next_frame - frame))[:, None, None]
+                polygons[span] = (1 - t) * padded[k] + t * padded[k + 1]
+            else:
+                polygons[span] = padded[k]
+        return cls(name, start_frame, polygons)
+
+    def contains(self, frame_index, x, y):
+        """Vectorised hit test of points (x, y) on the given frames; False outside the active range."""
+        frame_index = np.asarray(frame_index)
+        # Frame columns with gaps are float64 in the export cache; NaN frames compare False and stay inactive
+        active = (frame_index >= self.start_frame) & (frame_index <= self.end_frame)
+        hits = np.zeros(len(frame_index), dtype=bool)
+        polygon_index = frame_index[active].astype(np.intp) - self.start_frame
+        hits[active] = points_in_polygons(np.asarray(x)[active], np.asarray(y)[active], self.polygons, polygon_index)
+        return hits
+
+
+def points_in_polygons(x, y, polygons, polygon_index):
+    """
+    Even-odd point-in-polygon test of every point against polygons[polygon_index[i]]. The loop
+    runs over the polygon edges only, every edge is tested against all points at once.
+    """
+    inside = np.zeros(len(x), dtype=bool)
+    # Each edge runs from the previous vertex, so every vertex is gathered once
+    xj, yj = polygons[polygon_index, -1, 0], polygons[polygon_index, -1, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(polygons.shape[1]):
+            xi, yi = polygons[polygon_index, k, 0], polygons[polygon_index, k, 1]
+            crosses = (yi > y) != (yj > y)
+            inside ^= crosses & (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+            xj, yj = xi, yi
+    return inside
+
+
+def load_aois(aoi_path):
+    with open(aoi_path) as aoi_file:
+        definitions = json.load(aoi_file)
+    return [Aoi.from_keyframes(definition['name'], definition['keyframes'], definition.get('end_frame'),
+                               definition.get('interpolate', True))
+            for definition in definitions]
+
+
+def aoi_metrics(aois, gaze, fixations, min_confidence=0.6, max_sample_gap=0.1):
+    """
+    Dwell time, hit counts and time to first fixation of every AOI for one recording.
+
+    A gaze sample lasts until the next sample, at most max_sample_gap seconds, so tracking
+    losses do not count as dwell time. A fixation hits an AOI when its centroid is inside the
+    AOI on its start frame. Time to first fixation is measured from the AOI's onset, the first
+    gaze sample on or after its first frame, and is NaN when no fixation hits it.
+    """
+    gaze = gaze[gaze.confidence >= min_confidence].sort_values('gaze_timestamp', kind='stable')
+    gaze_timestamps = gaze.gaze_timestamp.to_numpy()
+    gaze_frames = gaze.world_index.to_numpy()
+    sample_durations = np.minimum(np.diff(gaze_timestamps, append=gaze_timestamps[-1:]), max_sample_gap)
+    fixation_frames = fixations.start_frame_index.to_numpy()
+
+    rows = []
+    for aoi in aois:
+        gaze_hits = aoi.contains(gaze_frames, gaze.norm_pos_x.to_numpy(), gaze.norm_pos_y.to_numpy())
+        fixation_hits = aoi.contains(fixation_frames, fixations.norm_pos_x.to_numpy(), fixations.norm_pos_y.to_numpy())
+
+        onset = np.flatnonzero(gaze_frames >= aoi.start_frame)[:1]
+        onset_timestamp = gaze_timestamps[onset[0]] if len(onset) else np.nan
+        first_hit = fixations.start_timestamp.to_numpy()[fixation_hits].min() if fixation_hits.any() else np.nan
+
+        rows.append({
+            'aoi': aoi.name,
+            'gaze_samples': int(gaze_hits.sum()),
+            'dwell_time': sample_durations[gaze_hits].sum(),
+            'fixation_count': int(fixation_hits.sum()),
+            'fixation_dwell_time': fixations.duration.to_numpy()[fixation_hits].sum() / 1000,
+            'time_to_first_fixation': first_hit - onset_timestamp,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dwell time, hits and time to first fixation per AOI and subject.')
+    parser.add_argument('aois', help='AOI definition JSON file')
+    parser.add_argument('exports', nargs='+', help='Pupil Player export directories with gaze_positions.csv '
+                                                   'and fixations.csv')
+    parser.add_argument('--root', help='Directory the subject and recording names are taken relative to '
+                                       '(default: the common parent of the exports)')
+    parser.add_argument('--min-confidence', type=float, default=0.6, help='Lowest confidence of a gaze sample')
+    parser.add_argument('--max-sample-gap', type=float, default=0.1,
+                        help='Longest time a single gaze sample counts for [sec]')
+    parser.add_argument('--output', default='aoi_metrics.csv', help='Path of the output CSV')
+    args = parser.parse_args()
+
+    try:
+        aois = load_aois(args.aois)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    root = args.root or os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in args.exports])
+
+    tables = []
+    for export_dir in args.exports:
+        gaze = export_cache.load_gaze_positions(os.path.join(export_dir, 'gaze_positions.csv')).dropna(
+            subset=['gaze_timestamp', 'world_index', 'norm_pos_x', 'norm_pos_y', 'confidence'])
+        fixations = export_cache.load_fixations(os.path.join(export_dir, 'fixations.csv'))
+        metrics = aoi_metrics(aois, gaze, fixations, args.min_confidence, args.max_sample_gap)
+        identity = pupil_batch.describe_recording(root, os.path.abspath(export_dir))
+        tables.append(metrics.assign(subject=identity['subject'], recording=identity['recording']))
+
+    table = pd.concat(tables, ignore_index=True)
+    table = table[['subject', 'recording'] + [column for column in table.columns if column not in ('subject', 'recording')]]
+    table.to_csv(args.output, index=False)
+    print(f"{len(aois)} AOIs, {len(args.exports)} recordings. Metrics written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
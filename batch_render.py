@@ -0,0 +1,142 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import traceback
+
+import pandas as pd
+from tqdm import tqdm
+
+import Temporal_Heatpmap_DP as renderer
+import export_cache
+
+MANIFEST_COLUMNS = ['video_path', 'gaze_positions', 'fixation_data', 'heatmap_video', 'fixation_video']
+WORLD_VIDEO_NAMES = ['world.mp4', 'world.avi', 'world.mkv']
+
+
+def find_world_video(export_dir):
+    """Return the world video of a Pupil Player export, looking in the export and its recording."""
+    # Pupil Player writes exports to <recording>/exports/<nnn>/
+    recording_dir = os.path.dirname(os.path.dirname(os.path.abspath(export_dir)))
+    for directory in (export_dir, recording_dir):
+        for name in WORLD_VIDEO_NAMES:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def discover_jobs(root):
+    """Build one render job per Pupil Player export found under root."""
+    jobs = []
+    for export_dir in export_cache.find_export_dirs(root, ('gaze_positions.csv', 'fixations.csv')):
+        jobs.append({
+            'video_path': find_world_video(export_dir),
+            'gaze_positions': os.path.join(export_dir, 'gaze_positions.csv'),
+            'fixation_data': os.path.join(export_dir, 'fixations.csv'),
+            'heatmap_video': os.path.join(export_dir, 'heatmap_video.mp4'),
+            'fixation_video': os.path.join(export_dir, 'fixation_video.mp4'),
+        })
+    return jobs
+
+
+def load_manifest(manifest_path):
+    """Read render jobs from a CSV manifest with one recording per row."""
+    manifest = pd.read_csv(manifest_path)
+    missing = set(MANIFEST_COLUMNS) - set(manifest.columns)
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {', '.join(sorted(missing))}")
+    return manifest[MANIFEST_COLUMNS].to_dict('records')
+
+
+def _is_file(path):
+    # Empty manifest cells are NaN and discovered exports without a world video have None
+    return isinstance(path, (str, os.PathLike)) and os.path.isfile(path)
+
+
+def is_up_to_date(job):
+    """Check whether both output videos exist and are newer than every input; False when an input is missing."""
+    inputs = [job['video_path'], job['gaze_positions'], job['fixation_data']]
+    outputs = [job['heatmap_video'], job['fixation_video']]
+    if not all(_is_file(path) for path in inputs + outputs):
+        return False
+    newest_input = max(os.path.getmtime(path) for path in inputs)
+    return min(os.path.getmtime(path) for path in outputs) >= newest_input
+
+
+def render_job(job, options):
+    """Render one recording in a worker process and return an error message, or None on success."""
+    try:
+        missing = [key for key in ('video_path', 'gaze_positions', 'fixation_data') if not _is_file(job[key])]
+        if missing:
+            return f"Missing input: {', '.join(missing)}"
+
+        sinks = [
+            renderer.load_heatmap_sink(job['gaze_positions'], job['heatmap_video'], **options['heatmap']),
+            renderer.load_fixation_sink(job['fixation_data'], job['fixation_video']),
+        ]
+        if any(sink is None for sink in sinks):
+            return "Gaze or fixation CSV does not contain the required columns"
+
+        renderer.render_overlays(job['video_path'], sinks, scale=options['scale'], pipeline=options['pipeline'],
+                                 reuse_buffers=options['reuse_buffers'], progress=False)
+
+        if not is_up_to_date(job):
+            return "Renderer did not write both output videos"
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+def run_batch(jobs, options, max_workers=None, force=False):
+    """Render all jobs in a process pool, skipping up-to-date ones, and return a summary dict."""
+    pending = [job for job in jobs if force or not is_up_to_date(job)]
+    summary = {'total': len(jobs), 'skipped': len(jobs) - len(pending), 'rendered': 0, 'failures': []}
+    print(f"{len(jobs)} recordings, {summary['skipped']} up to date, rendering {len(pending)}")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(render_job, job, options): job for job in pending}
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            job = futures[future]
+            try:
+                error = future.result()
+            except Exception as e:  # e.g. a worker process that died
+                error = f"Worker failed: {e}"
+            if error is None:
+                summary['rendered'] += 1
+            else:
+                print(f"Error rendering {job['video_path']}: {error.splitlines()[-1]}")
+                summary['failures'].append({**job, 'error': error})
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render heatmap and fixation videos for many recordings.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help=f"CSV manifest with columns: {', '.join(MANIFEST_COLUMNS)}")
+    source.add_argument('--root', help='Directory tree searched for Pupil Player exports')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of recordings rendered at once')
+    parser.add_argument('--force', action='store_true', help='Render recordings even if their outputs are up to date')
+    parser.add_argument('--summary', default='batch_render_summary.json', help='Path of the JSON run summary')
+    renderer.add_render_arguments(parser)
+    renderer.add_heatmap_arguments(parser)
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest) if args.manifest else discover_jobs(args.root)
+    options = {
+        'scale': args.scale,
+        'pipeline': args.pipeline,
+        'reuse_buffers': args.reuse_buffers,
+        'heatmap': renderer.heatmap_options(args),
+    }
+    summary = run_batch(jobs, options, max_workers=args.jobs, force=args.force)
+
+    with open(args.summary, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    print(f"Rendered {summary['rendered']}, skipped {summary['skipped']}, failed {len(summary['failures'])}. "
+          f"Summary written to {args.summary}")
+
+
+if __name__ == "__main__":
+    main()
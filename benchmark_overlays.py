@@ -0,0 +1,324 @@
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import pandas as pd
+
+import Temporal_Heatpmap_DP as renderer
+
+STAGES = ['decode', 'lookup', 'kernel', 'blend', 'fixation', 'encode']
+MODES = {
+    'serial': dict(pipeline=False, reuse_buffers=False),
+    'pipeline': dict(pipeline=True, reuse_buffers=False),
+    'reuse_buffers': dict(pipeline=False, reuse_buffers=True),
+    'pipeline_reuse_buffers': dict(pipeline=True, reuse_buffers=True),
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is in KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def make_synthetic_recording(directory, width=1280, height=720, fps=30, seconds=10, gaze_rate=200, seed=0):
+    """
+    Write a synthetic world video plus gaze_positions.csv and fixations.csv in the Pupil Player
+    export layout. Gaze alternates between fixations (gamma-distributed, ~250 ms) with small
+    jitter and short linear saccades, and the fixation table is derived from the same segments.
+    """
+    rng = np.random.default_rng(seed)
+    paths = {
+        'video_path': os.path.join(directory, 'world.mp4'),
+        'gaze_positions': os.path.join(directory, 'gaze_positions.csv'),
+        'fixation_data': os.path.join(directory, 'fixations.csv'),
+    }
+
+    frame_count = int(seconds * fps)
+    background = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+    background = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+    video_writer = cv2.VideoWriter(paths['video_path'], cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for frame_idx in range(frame_count):
+        video_writer.write(np.roll(background, frame_idx * 8, axis=1))
+    video_writer.release()
+
+    # Build fixation / saccade segments until the recording is covered
+    sample_count = int(seconds * gaze_rate)
+    segments = []
+    covered = 0
+    center = rng.uniform(0.2, 0.8, 2)
+    while covered < sample_count:
+        fixation_samples = max(int(rng.gamma(4.0, 0.0625) * gaze_rate), 1)
+        segments.append(('fixation', covered, min(covered + fixation_samples, sample_count), center))
+        covered += fixation_samples
+        saccade_samples = max(int(0.04 * gaze_rate), 1)
+        target = np.clip(center + rng.normal(0, 0.2, 2), 0.05, 0.95)
+        segments.append(('saccade', covered, min(covered + saccade_samples, sample_count), (center, target)))
+        covered += saccade_samples
+        center = target
+
+    norm_pos = np.empty((sample_count, 2))
+    for kind, start, end, where in segments:
+        if start >= end:
+            continue
+        if kind == 'fixation':
+            norm_pos[start:end] = where + rng.normal(0, 0.01, (end - start, 2))
+        else:
+            steps = np.linspace(0, 1, end - start)[:, None]
+            norm_pos[start:end] = where[0] + steps * (where[1] - where[0])
+
+    start_timestamp = 1000.0
+    gaze_timestamp = start_timestamp + np.arange(sample_count) / gaze_rate
+    world_index = np.minimum(((gaze_timestamp - start_timestamp) * fps).astype(int), frame_count - 1)
+    gaze = pd.DataFrame({
+        'gaze_timestamp': gaze_timestamp,
+        'world_index': world_index,
+        'confidence': rng.uniform(0.8, 1.0, sample_count),
+        'norm_pos_x': norm_pos[:, 0],
+        'norm_pos_y': norm_pos[:, 1],
+        'gaze_point_3d_x': (norm_pos[:, 0] - 0.5) * 500,
+        'gaze_point_3d_y': (0.5 - norm_pos[:, 1]) * 400,
+        'gaze_point_3d_z': 600 + rng.normal(0, 5, sample_count),
+    })
+    gaze.to_csv(paths['gaze_positions'], index=False)
+
+    fixation_rows = []
+    for kind, start, end, where in segments:
+        if kind != 'fixation' or start >= end:
+            continue
+        fixation_rows.append({
+            'id': len(fixation_rows),
+            'start_timestamp': gaze_timestamp[start],
+            'duration': (gaze_timestamp[end - 1] - gaze_timestamp[start]) * 1000,
+            'start_frame_index': world_index[start],
+            'end_frame_index': world_index[end - 1],
+            'norm_pos_x': norm_pos[start:end, 0].mean(),
+            'norm_pos_y': norm_pos[start:end, 1].mean(),
+            'dispersion': np.degrees(norm_pos[start:end].std()),
+            'confidence': 0.9,
+            'method': 'synthetic',
+        })
+    pd.DataFrame(fixation_rows).to_csv(paths['fixation_data'], index=False)
+    return paths
+
+
+def _timed(function, timings, stage):
+    def wrapper(*args, **kwargs):
+        began = time.perf_counter()
+        result = function(*args, **kwargs)
+        timings[stage] += time.perf_counter() - began
+        return result
+    return wrapper
+
+
+def benchmark_stages(paths, output_dir, heatmap_options, scale=1.0):
+    """
+    Run the heatmap and fixation overlays serially and time each stage separately. The lookup
+    and kernel stages are measured by wrapping the heatmap sink's own methods, so the blend time
+    is what remains of the heatmap overlay.
+    """
+    timings = dict.fromkeys(STAGES, 0.0)
+    heatmap_sink = renderer.load_heatmap_sink(paths['gaze_positions'], os.path.join(output_dir, 'heatmap.mp4'),
+                                              **heatmap_options)
+    fixation_sink = renderer.load_fixation_sink(paths['fixation_data'], os.path.join(output_dir, 'fixation.mp4'))
+
+    cap = cv2.VideoCapture(paths['video_path'])
+    frame_rate = cap.get(cv2.CAP_PROP_FPS)
+    frames = renderer.iter_capture_frames(cap, scale)
+    frame_count = 0
+    heatmap_time = 0.0
+
+    while True:
+        began = time.perf_counter()
+        frame = next(frames, None)
+        timings['decode'] += time.perf_counter() - began
+        if frame is None:
+            break
+
+        if frame_count == 0:
+            height, width, _ = frame.shape
+            for sink in (heatmap_sink, fixation_sink):
+                sink.open(width, height, frame_rate)
+            heatmap_sink.gaze_pixels = _timed(heatmap_sink.gaze_pixels, timings, 'lookup')
+            heatmap_sink.accumulator.update = _timed(heatmap_sink.accumulator.update, timings, 'kernel')
+
+        began = time.perf_counter()
+        heatmap = heatmap_sink.overlay(frame_count, frame)
+        heatmap_time += time.perf_counter() - began
+
+        began = time.perf_counter()
+        fixation = fixation_sink.overlay(frame_count, frame)
+        timings['fixation'] += time.perf_counter() - began
+
+        began = time.perf_counter()
+        if heatmap is not None:
+            heatmap_sink.write(heatmap)
+        fixation_sink.write(fixation)
+        timings['encode'] += time.perf_counter() - began
+        frame_count += 1
+
+    for sink in (heatmap_sink, fixation_sink):
+        sink.close()
+    timings['blend'] = heatmap_time - timings['lookup'] - timings['kernel']
+
+    return frame_count, {
+        stage: {'seconds': seconds, 'fps': frame_count / seconds if seconds > 0 else None}
+        for stage, seconds in timings.items()
+    }
+
+
+def _benchmark_mode(paths, output_dir, heatmap_options, scale, mode):
+    sinks = [
+        renderer.load_heatmap_sink(paths['gaze_positions'], os.path.join(output_dir, f'heatmap_{mode}.mp4'),
+                                   **heatmap_options),
+        renderer.load_fixation_sink(paths['fixation_data'], os.path.join(output_dir, f'fixation_{mode}.mp4')),
+    ]
+    began = time.perf_counter()
+    renderer.render_frame_range(paths['video_path'], sinks, scale=scale, progress=False, **MODES[mode])
+    seconds = time.perf_counter() - began
+    return sinks[1].frames_written, seconds, peak_rss_mb()
+
+
+def benchmark_modes(paths, output_dir, heatmap_options, scale=1.0):
+    """Time full renders in each mode, each in a fresh spawned process so peak RSS is per mode."""
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for mode in MODES:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            frames, seconds, rss = pool.submit(_benchmark_mode, paths, output_dir, heatmap_options, scale, mode).result()
+        results[mode] = {'seconds': seconds, 'fps': frames / seconds if seconds > 0 else None, 'peak_rss_mb': rss}
+    return results
+
+
+def check_kernel_equivalence(paths, frame_size, grid_scale=2, sigma=5.0, max_frames=200):
+    """Largest relative difference between the splat and histogram kernels over real gaze frames."""
+    surface_df = pd.read_csv(paths['gaze_positions'])
+    gaze_index = renderer.GazeFrameIndex.from_dataframe(surface_df)
+    height, width = frame_size
+    grid = (height // grid_scale, width // grid_scale)
+    reference = renderer.HistogramKernel(frame_size, grid, sigma)
+    splat = renderer.SplatKernel(frame_size, grid, sigma)
+
+    worst = 0.0
+    for world_index in range(gaze_index.first_index, gaze_index.first_index + max_frames):
+        samples = gaze_index.samples(world_index)
+        if samples is None:
+            continue
+        gaze_y, gaze_x = (1 - samples[1]) * height, samples[0] * width
+        expected = reference(gaze_y, gaze_x)
+        if not expected.max() > 0:
+            continue
+        worst = max(worst, float(np.abs(splat(gaze_y, gaze_x) - expected).max() / expected.max()))
+    return worst
+
+
+def check_reuse_allocations(paths, output_dir, heatmap_options, warmup_frames=10, max_frames=100):
+    """Median bytes allocated transiently per frame by the overlays once buffers are reused."""
+    sinks = [
+        renderer.load_heatmap_sink(paths['gaze_positions'], os.path.join(output_dir, 'heatmap_alloc.mp4'),
+                                   **heatmap_options),
+        renderer.load_fixation_sink(paths['fixation_data'], os.path.join(output_dir, 'fixation_alloc.mp4')),
+    ]
+    cap = cv2.VideoCapture(paths['video_path'])
+    frame_rate = cap.get(cv2.CAP_PROP_FPS)
+    frames = renderer.iter_capture_frames(cap, buffer_count=1)
+
+    transient = []
+    tracemalloc.start()
+    try:
+        for frame_idx, frame in enumerate(frames):
+            if frame_idx == max_frames:
+                break
+            if frame_idx == 0:
+                height, width, _ = frame.shape
+                for sink in sinks:
+                    sink.open(width, height, frame_rate, buffer_count=1)
+
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            for sink in sinks:
+                image = sink.overlay(frame_idx, frame)
+                if image is not None:
+                    sink.write(image)
+            image = None
+            transient.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+        frames.close()
+        for sink in sinks:
+            sink.close()
+
+    return int(np.median(transient[warmup_frames:])) if len(transient) > warmup_frames else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the gaze overlay renderers on synthetic recordings.')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--seconds', type=float, default=10, help='Length of the synthetic recording')
+    parser.add_argument('--gaze-rate', type=float, default=200, help='Gaze sampling rate in Hz')
+    renderer.add_render_arguments(parser, modes=False)
+    parser.add_argument('--workdir', help='Keep the synthetic recording and outputs here instead of a temp dir')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--skip-modes', action='store_true', help='Only run the per-stage benchmark')
+    parser.add_argument('--check', action='store_true',
+                        help='Exit with an error if the kernel equivalence or allocation checks regress')
+    parser.add_argument('--max-alloc-bytes', type=int, default=256 * 1024,
+                        help='Allowed transient allocation per frame in buffer-reuse mode for --check')
+    renderer.add_heatmap_arguments(parser)
+    args = parser.parse_args()
+
+    heatmap_options = renderer.heatmap_options(args)
+    with tempfile.TemporaryDirectory(prefix='overlay_benchmark_') as temp_dir:
+        workdir = args.workdir or temp_dir
+        os.makedirs(workdir, exist_ok=True)
+
+        paths = make_synthetic_recording(workdir, args.width, args.height, args.fps, args.seconds, args.gaze_rate)
+        frame_count, stages = benchmark_stages(paths, workdir, heatmap_options, args.scale)
+        report = {
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'workdir')},
+            'frames': frame_count,
+            'stages': stages,
+        }
+        if not args.skip_modes:
+            report['modes'] = benchmark_modes(paths, workdir, heatmap_options, args.scale)
+
+        frame_size = (int(args.height * args.scale), int(args.width * args.scale))
+        report['checks'] = {
+            'kernel_max_relative_error': check_kernel_equivalence(paths, frame_size, args.grid_scale, args.sigma),
+            'reuse_alloc_bytes_per_frame': check_reuse_allocations(paths, workdir, heatmap_options),
+        }
+        report['peak_rss_mb'] = peak_rss_mb()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(text + '\n')
+    else:
+        print(text)
+
+    if args.check:
+        failures = []
+        if report['checks']['kernel_max_relative_error'] > 1e-9:
+            failures.append('splat kernel no longer matches the histogram kernel')
+        allocated = report['checks']['reuse_alloc_bytes_per_frame']
+        if args.heatmap_kernel == 'splat' and allocated is not None and allocated > args.max_alloc_bytes:
+            failures.append(f'buffer-reuse mode allocates {allocated} bytes per frame')
+        for failure in failures:
+            print(f"Check failed: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Command line tools whose import cost is paid on every run
+DEFAULT_MODULES = ['export_cache', 'gaze_analysis', 'pupil_Analysis', 'Temporal_Heatpmap_DP', 'batch_render']
+
+# Packages that must only be imported by the code paths that use them
+HEAVY_PACKAGES = ['matplotlib', 'seaborn', 'scipy', 'torch', 'torchvision', 'transformers']
+
+
+def parse_importtime(stderr):
+    """
+    Parse `python -X importtime` output into (name, depth, self_us, cumulative_us) rows, where
+    depth 0 is a module imported directly by the command.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure_import(module, cwd):
+    """Import module in a fresh interpreter and return its import rows and the loaded module names."""
+    code = f"import sys, {module}; print(' '.join(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd,
+                            capture_output=True, text=True, check=True)
+    return parse_importtime(result.stderr), result.stdout.split()
+
+
+def benchmark_module(module, cwd, repeats=5, top=5):
+    """Median import time of module over repeats fresh interpreters, with its heaviest direct imports."""
+    # The first import compiles the module, which later runs of the tools do not pay
+    measure_import(module, cwd)
+
+    times_ms = []
+    for _ in range(repeats):
+        rows, loaded = measure_import(module, cwd)
+        times_ms.append(next(cumulative for name, depth, _, cumulative in rows
+                             if name == module and depth == 0) / 1000)
+
+    direct = [(name, cumulative / 1000) for name, depth, _, cumulative in rows if depth == 1]
+    loaded_packages = {name.split('.')[0] for name in loaded}
+    return {
+        'import_ms': statistics.median(times_ms),
+        'heaviest_imports_ms': dict(sorted(direct, key=lambda item: -item[1])[:top]),
+        'heavy_packages': sorted(loaded_packages & set(HEAVY_PACKAGES)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of the command line tools.')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='Modules to import')
+    parser.add_argument('--repeats', type=int, default=5, help='Fresh interpreters per module')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--check', action='store_true',
+                        help='Exit with an error if a module is over budget or imports a heavy package')
+    parser.add_argument('--budget-ms', type=float, default=1000,
+                        help='Allowed import time per module for --check')
+    args = parser.parse_args()
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    report = {module: benchmark_module(module, repo_dir, args.repeats) for module in args.modules}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(text + '\n')
+    else:
+        print(text)
+
+    if args.check:
+        failures = []
+        for module, result in report.items():
+            if result['import_ms'] > args.budget_ms:
+                failures.append(f"{module} takes {result['import_ms']:.0f} ms to import")
+            if result['heavy_packages']:
+                failures.append(f"{module} imports {', '.join(result['heavy_packages'])} at startup")
+        for failure in failures:
+            print(f"Check failed: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ import os
 import random
 from moviepy.video.io.VideoFileClip import VideoFileClip
 
+from media_metadata import load_durations
+
 # Configuration
 num_people = 25
 videos_per_class = 25
@@ -129,9 +131,11 @@ def process_videos(files):
     processed_videos = []
     split_videos = []  # List to hold segments from split videos
 
-    for file in files:
-        clip = VideoFileClip(file)
-        if clip.duration > 60:
+    # Durations come from the metadata cache instead of opening every clip
+    for file, duration in zip(files, load_durations(files)):
+        if duration is None:
+            raise ValueError(f"Could not read the duration of {file}")
+        if duration > 60:
             print(f"Video {file} is longer than 60 seconds, splitting...")
             segments = split_video(file)
             # Randomly select one of the segments to replace the original video
@@ -140,7 +144,6 @@ def process_videos(files):
             split_videos.extend(segments)  # Store all segments created
         else:
             processed_videos.append(file)  # Keep the original if it's <= 60 seconds
-        clip.close()
 
     return processed_videos, split_videos  # Return both processed and split videos
 
@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+"""
+Columns read from each Pupil Player export and the dtypes they are stored with. Timestamps,
+durations and confidences stay float64 because they are compared against thresholds and
+each other; positions and diameters only need float32.
+"""
+GAZE_POSITIONS = {
+    'gaze_timestamp': 'float64',
+    'world_index': 'int32',
+    'confidence': 'float64',
+    'norm_pos_x': 'float32',
+    'norm_pos_y': 'float32',
+    'gaze_point_3d_x': 'float32',
+    'gaze_point_3d_y': 'float32',
+    'gaze_point_3d_z': 'float32',
+}
+
+PUPIL_POSITIONS = {
+    'pupil_timestamp': 'float64',
+    'method': 'category',
+    'diameter_3d': 'float32',
+    'confidence': 'float64',
+}
+
+FIXATIONS = {
+    'id': 'int32',
+    'start_timestamp': 'float64',
+    'duration': 'float64',
+    'start_frame_index': 'int32',
+    'end_frame_index': 'int32',
+    'norm_pos_x': 'float32',
+    'norm_pos_y': 'float32',
+    'dispersion': 'float32',
+    'confidence': 'float64',
+}
+
+SCHEMAS = {
+    'gaze_positions.csv': GAZE_POSITIONS,
+    'pupil_positions.csv': PUPIL_POSITIONS,
+    'fixations.csv': FIXATIONS,
+}
+
+CACHE_DIR_NAME = '.export_cache'
+CACHE_VERSION = 1
+
+
+def source_key(csv_path):
+    """Size and modification time of a file, which change whenever the export is rewritten."""
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _cache_path(csv_path, schema, cache_dir=None):
+    schema_hash = hashlib.sha1(json.dumps(schema, sort_keys=True).encode()).hexdigest()[:10]
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(csv_path)), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, f"{os.path.basename(csv_path)}.{schema_hash}")
+
+
+def _schema_columns(csv_path, schema):
+    header = pd.read_csv(csv_path, nrows=0).columns
+    return [column for column in schema if column in header]
+
+
+def _convert(data, schema, columns):
+    for column in columns:
+        dtype = schema[column]
+        if dtype.startswith('int') and data[column].isna().any():
+            # Integer columns with gaps keep NaN as float64 instead of failing the cast
+            data[column] = data[column].astype('float64')
+        else:
+            data[column] = data[column].astype(dtype)
+    return data[columns]
+
+
+def parse_export(csv_path, schema):
+    """Parse only the schema's columns that exist in the CSV and convert them to compact dtypes."""
+    columns = _schema_columns(csv_path, schema)
+    return _convert(pd.read_csv(csv_path, usecols=columns), schema, columns)
+
+
+def iter_export_chunks(csv_path, schema=None, chunk_size=100_000):
+    """
+    Yield a Pupil Player export CSV in blocks of chunk_size rows, converted exactly like
+    parse_export, for exports too large to hold in memory. The cache is not used.
+    """
+    schema = schema or SCHEMAS[os.path.basename(csv_path)]
+    columns = _schema_columns(csv_path, schema)
+    with pd.read_csv(csv_path, usecols=columns, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield _convert(chunk, schema, columns)
+
+
+def _write_cache(path, data, source):
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging_', dir=parent)
+    os.chmod(staging, 0o755)
+    meta = {'version': CACHE_VERSION, 'source': source, 'rows': len(data), 'columns': {}}
+
+    for column in data.columns:
+        values = data[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(staging, f"{column}.npy"), values.cat.codes.to_numpy())
+            meta['columns'][column] = {'categories': values.cat.categories.tolist()}
+        else:
+            np.save(os.path.join(staging, f"{column}.npy"), values.to_numpy())
+            meta['columns'][column] = {}
+
+    with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    # Swap the finished directory in, so readers never see a half-written cache
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.replace(staging, path)
+    except OSError:
+        # Another process finished the same cache first
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _read_cache(path, source):
+    try:
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION or meta.get('source') != source:
+        return None
+
+    columns = {}
+    try:
+        for column, info in meta['columns'].items():
+            # Copy-on-write mapping: pages are read lazily and callers may still modify the frame
+            values = np.load(os.path.join(path, f"{column}.npy"), mmap_mode='c')
+            if 'categories' in info:
+                values = pd.Categorical.from_codes(values, info['categories'])
+            columns[column] = values
+    except (OSError, ValueError):
+        # A concurrent rebuild replaced the cache between reading meta.json and its columns
+        return None
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_export(csv_path, schema=None, use_cache=True, cache_dir=None):
+    """
+    Return a Pupil Player export CSV as a DataFrame holding the schema's columns in compact dtypes.
+    The parsed columns are cached as memory-mapped .npy files next to the CSV (or in cache_dir),
+    keyed by the CSV's size and mtime, so later loads skip parsing entirely. If the cache can not
+    be written, for example on a read-only export, the parsed frame is returned as is.
+    """
+    schema = schema or SCHEMAS[os.path.basename(csv_path)]
+    if not use_cache:
+        return parse_export(csv_path, schema)
+
+    source = source_key(csv_path)
+    path = _cache_path(csv_path, schema, cache_dir)
+    cached = _read_cache(path, source)
+    if cached is not None:
+        return cached
+
+    data = parse_export(csv_path, schema)
+    try:
+        _write_cache(path, data, source)
+    except OSError as e:
+        print(f"Warning: could not cache {csv_path}: {e}")
+        return data
+    cached = _read_cache(path, source)
+    return data if cached is None else cached
+
+
+def load_gaze_positions(csv_path, **kwargs):
+    return load_export(csv_path, GAZE_POSITIONS, **kwargs)
+
+
+def load_pupil_positions(csv_path, **kwargs):
+    return load_export(csv_path, PUPIL_POSITIONS, **kwargs)
+
+
+def load_fixations(csv_path, **kwargs):
+    return load_export(csv_path, FIXATIONS, **kwargs)
+
+
+def find_export_dirs(root, required_files):
+    """Walk root and return every directory that contains all of the required export files."""
+    export_dirs = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if name != CACHE_DIR_NAME]
+        if all(name in file_names for name in required_files):
+            export_dirs.append(dir_path)
+    return sorted(export_dirs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the columnar cache for every Pupil Player export under a directory.')
+    parser.add_argument('root', help='Directory searched for gaze_positions.csv, pupil_positions.csv and fixations.csv')
+    args = parser.parse_args()
+
+    for dir_path, dir_names, file_names in os.walk(args.root):
+        dir_names[:] = [name for name in dir_names if name != CACHE_DIR_NAME]
+        for file_name in sorted(set(file_names) & set(SCHEMAS)):
+            csv_path = os.path.join(dir_path, file_name)
+            data = load_export(csv_path)
+            print(f"Cached {csv_path}: {len(data)} rows, {len(data.columns)} columns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import subprocess
+import time
+
+"""
+Runs ffmpeg and ffprobe commands as asyncio subprocesses, at most max_concurrency at a time.
+Each job gets a timeout and a number of retries; results come back in submission order, and
+are reported in that order as soon as a job and all jobs before it have finished, so the log
+reads like a sequential run while the cores stay busy.
+"""
+
+
+class Job:
+    """A command to run; timeout [sec] and retries override the defaults of run_jobs when set."""
+
+    def __init__(self, cmd, name=None, timeout=None, retries=None):
+        self.cmd = [str(arg) for arg in cmd]
+        self.name = name or ' '.join(self.cmd)
+        self.timeout = timeout
+        self.retries = retries
+
+
+class JobResult:
+    """Outcome of a job: its last attempt's return code and output, or an error message."""
+
+    def __init__(self, job, returncode, stdout, stderr, attempts, elapsed, error=None):
+        self.job = job
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _last_line(output):
+    lines = output.decode(errors='replace').strip().splitlines()
+    return lines[-1] if lines else ''
+
+
+async def _run_job(job, semaphore, timeout, retries, retry_delay):
+    timeout = job.timeout if job.timeout is not None else timeout
+    retries = job.retries if job.retries is not None else retries
+    async with semaphore:
+        start = time.perf_counter()
+        for attempt in range(1, retries + 2):
+            try:
+                # Without stdin ffmpeg cannot wait for keyboard input or steal the terminal's
+                process = await asyncio.create_subprocess_exec(
+                    *job.cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as e:  # a missing executable does not improve with retries
+                return JobResult(job, None, b'', b'', attempt, time.perf_counter() - start,
+                                 f"Could not start {job.cmd[0]}: {e}")
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                stdout, stderr = await process.communicate()
+                error = f"Timed out after {timeout} seconds"
+            else:
+                if process.returncode == 0:
+                    return JobResult(job, 0, stdout, stderr, attempt, time.perf_counter() - start)
+                error = f"Exited with code {process.returncode}: {_last_line(stderr)}"
+            if attempt <= retries:
+                await asyncio.sleep(retry_delay * attempt)
+        return JobResult(job, process.returncode, stdout, stderr, attempt, time.perf_counter() - start, error)
+
+
+async def _run_all(jobs, max_concurrency, timeout, retries, retry_delay, on_result):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = [asyncio.ensure_future(_run_job(job, semaphore, timeout, retries, retry_delay)) for job in jobs]
+    results = []
+    for task in tasks:
+        result = await task
+        if on_result is not None:
+            on_result(result)
+        results.append(result)
+    return results
+
+
+def run_jobs(jobs, max_concurrency=None, timeout=None, retries=0, retry_delay=1.0, on_result=None):
+    """
+    Run jobs concurrently and return their JobResults in the order of jobs. Failed and timed
+    out jobs are retried after retry_delay * attempt seconds. on_result is called with every
+    result in job order.
+    """
+    max_concurrency = max_concurrency or os.cpu_count()
+    return asyncio.run(_run_all(list(jobs), max_concurrency, timeout, retries, retry_delay, on_result))
+
@@ -1,8 +1,11 @@
 import os
 import random
-import subprocess
 import pandas as pd
 
+from ffmpeg_scheduler import run_jobs
+from media_metadata import load_durations
+from video_segments import segment_jobs
+
 # Configurations
 num_people = 25
 videos_per_person_per_class = 5
@@ -10,90 +13,34 @@ files_per_label = 5
 label_0 = 0
 label_1 = 1
 output_base_dir = "/path/to/save/split_videos"  # Specify the save directory
+ffmpeg_jobs = os.cpu_count()  # FFmpeg and FFprobe processes run at once
+probe_timeout = 60  # Seconds before an FFprobe call is abandoned (metadata cache misses only)
+encode_timeout = None  # Seconds before an FFmpeg encode is abandoned, None waits indefinitely
+job_retries = 1  # Extra attempts for a failed or timed out call
+segment_mode = 'segment'  # 'segment' (one pass), 'seek' (one job per part) or 'copy' (no re-encode, keyframe cuts)
 
 required_videos_per_label = files_per_label * num_people
 
 
-def run_ffmpeg_command(cmd):
-    """Run FFmpeg command and handle errors."""
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg error: {e}")
-
-
-def process_video(input_path, save_dir):
-    """Process the video using FFmpeg."""
-    print(f"Processing: {input_path}")
-
-    # Get video duration
-    cmd_duration = [
-        'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1', input_path
-    ]
-    duration = float(subprocess.check_output(cmd_duration).strip())
-    print(f"Loaded: {input_path}, Duration: {duration:.2f} seconds")
-
-    base_name = os.path.splitext(os.path.basename(input_path))[0]
-    video_dir = os.path.join(save_dir, base_name)
-    os.makedirs(video_dir, exist_ok=True)
-
-    if duration < 60:  # Save short videos directly
-        output_path = os.path.join(video_dir, f"{base_name}.mp4")
-        cmd_save = ['ffmpeg', '-i', input_path, '-c:v', 'libx264', output_path]
-        run_ffmpeg_command(cmd_save)
-        print(f"Saved short video: {output_path}")
-        return
-
-    # Split the video into 5 parts or with a leftover
-    total_duration = min(duration, 300)  # Cap at 5 minutes
-    segment_duration = total_duration / 5
-    segments = []
-    start = 0
-
-    for i in range(5):
-        end = min(start + segment_duration, total_duration)
-        segment_path = os.path.join(video_dir, f"part_{i + 1}.mp4")
-        cmd_split = [
-            'ffmpeg', '-i', input_path, '-ss', str(start), '-to', str(end),
-            '-c:v', 'libx264', segment_path
-        ]
-        run_ffmpeg_command(cmd_split)
-        segments.append(segment_path)
-        print(f"Segment {i + 1}: {end - start:.2f} seconds")
-        start = end
-        if start >= total_duration:
-            break
-
-    if duration > total_duration:
-        leftover_path = os.path.join(video_dir, f"leftover.mp4")
-        cmd_leftover = [
-            'ffmpeg', '-i', input_path, '-ss', str(total_duration),
-            '-c:v', 'libx264', leftover_path
-        ]
-        run_ffmpeg_command(cmd_leftover)
-        segments.append(leftover_path)
-        print(f"Leftover Segment: {duration - total_duration:.2f} seconds")
-
-    print(f"Processed {input_path} into {len(segments)} segments.")
+def report_job(result):
+    """Print the outcome of an FFmpeg job."""
+    if result.ok:
+        print(result.job.name)
+    else:
+        print(f"FFmpeg error in {result.job.name}: {result.error}")
 
 
 def filter_videos_by_duration(video_paths, min_duration=10):
     """Filter videos by minimum duration using FFmpeg."""
     valid_videos = []
-    for path in video_paths:
-        try:
-            cmd_duration = [
-                'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1', path
-            ]
-            duration = float(subprocess.check_output(cmd_duration).strip())
-            if duration >= min_duration:
-                valid_videos.append(path)
-            else:
-                print(f"Skipped {path}: Duration {duration:.2f} seconds (too short)")
-        except Exception as e:
-            print(f"Error loading {path}: {e}")
+    durations = load_durations(video_paths, max_concurrency=ffmpeg_jobs, timeout=probe_timeout, retries=job_retries)
+    for path, duration in zip(video_paths, durations):
+        if duration is None:
+            continue
+        if duration >= min_duration:
+            valid_videos.append(path)
+        else:
+            print(f"Skipped {path}: Duration {duration:.2f} seconds (too short)")
     return valid_videos
 
 
@@ -148,12 +95,21 @@ def process_videos(video_files, label):
     label_dir = os.path.join(output_base_dir, f"label_{label}")
     os.makedirs(label_dir, exist_ok=True)
 
-    for video_path in video_files:
+    durations = load_durations(video_files, max_concurrency=ffmpeg_jobs, timeout=probe_timeout, retries=job_retries)
+    jobs = []
+    for video_path, duration in zip(video_files, durations):
+        if duration is None:
+            continue
+        print(f"Loaded: {video_path}, Duration: {duration:.2f} seconds")
         try:
-            process_video(video_path, label_dir)
+            jobs.extend(segment_jobs(video_path, duration, label_dir, mode=segment_mode, timeout=encode_timeout))
         except Exception as e:
             print(f"Error processing {video_path}: {e}")
 
+    results = run_jobs(jobs, max_concurrency=ffmpeg_jobs, retries=job_retries, on_result=report_job)
+    print(f"Processed {len(video_files)} videos, {sum(not result.ok for result in results)} of {len(jobs)} "
+          f"FFmpeg jobs failed.")
+
 
 print("Processing label 0 videos...")
 process_videos(label_0_files[:required_videos_per_label], label_0)
@@ -2,23 +2,33 @@ import argparse
 import os
 import numpy as np
 import pandas as pd
-import seaborn as sns
 
-sns.set(context="notebook", style="whitegrid", font_scale=1.2)
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
+import export_cache
+import plotting
+
+# Log-spaced gaze velocity histogram bins in deg/sec
+VELOCITY_BINS = np.logspace(-1, np.log10(500), 50)
+
+# Plot sizes of the fast plotting mode: they follow the output resolution, not the sample count
+TIME_SERIES_BUCKETS = 2000
+DENSITY_BINS = 400
+SPHERE_POINTS = 20000
+
+
+def flip_negative_z(exported_gaze):
+    negative_z_mask = exported_gaze.gaze_point_3d_z < 0
+    negative_z_values = exported_gaze.loc[negative_z_mask, ["gaze_point_3d_z"]]
+    exported_gaze.loc[negative_z_mask, ["gaze_point_3d_z"]] = negative_z_values * -1
+    return exported_gaze
 
 
 def load_process(file_path):
     exported_gaze_file = file_path
-    exported_gaze = pd.read_csv(exported_gaze_file).dropna()
+    exported_gaze = export_cache.load_gaze_positions(exported_gaze_file).dropna()
     exported_gaze.info()
     print(exported_gaze.gaze_point_3d_z)
-    negative_z_mask = exported_gaze.gaze_point_3d_z < 0
-    negative_z_values = exported_gaze.loc[negative_z_mask, ["gaze_point_3d_z"]]
-    exported_gaze.loc[negative_z_mask, ["gaze_point_3d_z"]] = negative_z_values * -1
 
-    return exported_gaze
+    return flip_negative_z(exported_gaze)
 
 
 def cart_to_spherical(data, apply_rad2deg=False):
@@ -36,15 +46,66 @@ def cart_to_spherical(data, apply_rad2deg=False):
     return r, theta, phi
 
 
-def sphere_pos_over_time(ts, data, unit="radians"):
+def decimate_min_max(x, y, buckets):
+    """
+    Reduce a time series to the minimum and maximum sample of each of buckets equal index ranges,
+    in their original order, so a line plot of the result keeps every peak of the full series.
+    NaN samples are only kept for buckets that hold nothing else.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    if len(y) <= 2 * buckets:
+        return x, y
+
+    size = -(-len(y) // buckets)
+    padded = np.full(size * buckets, np.nan)
+    padded[:len(y)] = y
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    low = offsets + np.where(np.isnan(padded), np.inf, padded).argmin(axis=1)
+    high = offsets + np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1)
+
+    indices = np.unique(np.concatenate([low, high]))
+    indices = indices[indices < len(y)]
+    return x[indices], y[indices]
+
+
+def sphere_pos_over_time(ts, data, unit="radians", buckets=None):
+    plt = plotting.pyplot()
     for key, values in data.items():
-        sns.lineplot(x=ts, y=values, label=key)
+        if buckets:
+            plt.plot(*decimate_min_max(ts, values, buckets), label=key, linewidth=0.8)
+        else:
+            plotting.seaborn().lineplot(x=ts, y=values, label=key)
         plt.xlabel("time [sec]")
         plt.ylabel(unit)
         plt.legend()
 
 
+def sphere_density(theta, phi, unit="radians", bins=DENSITY_BINS):
+    # Binned sample counts drawn as one image instead of a scatter of every sample
+    plt = plotting.pyplot()
+    from matplotlib import colors
+    finite = np.isfinite(theta) & np.isfinite(phi)
+    counts, theta_edges, phi_edges = np.histogram2d(np.asarray(theta)[finite], np.asarray(phi)[finite], bins=bins)
+    image = plt.imshow(
+        np.ma.masked_equal(counts.T, 0),
+        origin="lower",
+        extent=(theta_edges[0], theta_edges[-1], phi_edges[0], phi_edges[-1]),
+        aspect="auto",
+        interpolation="nearest",
+        cmap="cubehelix",
+        norm=colors.LogNorm(),
+    )
+    cbar = plt.colorbar(image)
+    cbar.ax.set_ylabel("samples per bin", rotation=270)
+    cbar.ax.get_yaxis().labelpad = 15
+    plt.xlabel(f"theta [{unit[:3]}]")
+    plt.ylabel(f"phi [{unit[:3]}]")
+
+
 def sphere_pos(r, theta, phi, unit="radians"):
+    plt = plotting.pyplot()
+    from matplotlib import colors
     print(r.min(), r.max())
     norm = colors.LogNorm(vmin=r.min(), vmax=r.max())
     points = plt.scatter(
@@ -62,48 +123,250 @@ def sphere_pos(r, theta, phi, unit="radians"):
     plt.ylabel(f"phi [{unit[:3]}]")
 
 
-def gaze_velocity_calculation(exported_gaze, output_dir):
+def gaze_velocity_calculation(exported_gaze, output_dir, fast=False):
+    plt = plotting.pyplot()
     print('Constructing Gaze Velocity Diagram')
     r, theta, phi = cart_to_spherical(exported_gaze, apply_rad2deg=True)
+    buckets = TIME_SERIES_BUCKETS if fast else None
     plt.figure(figsize=(16, 4))
 
     plt.subplot(1, 2, 1)
     sphere_pos_over_time(
         exported_gaze.gaze_timestamp,
         data={"theta": theta, "phi": phi},
-        unit="degrees"
+        unit="degrees",
+        buckets=buckets
     )
 
     plt.subplot(1, 2, 2)
-    sphere_pos(r, theta, phi, unit="degrees")
+    if fast:
+        sphere_density(theta, phi, unit="degrees")
+    else:
+        sphere_pos(r, theta, phi, unit="degrees")
 
     # Save output files in the same directory as the gaze file
     plt.savefig(os.path.join(output_dir, 'gaze_velocity_scatter_plot.png'))
 
-    squared_theta_diff = np.diff(theta) ** 2
-    squared_phi_diff = np.diff(phi) ** 2
-    deg_diff = np.sqrt(squared_theta_diff + squared_phi_diff)
-    ts_diff = np.diff(exported_gaze.gaze_timestamp)
-    deg_per_sec = deg_diff / ts_diff
+    deg_per_sec = angular_velocity(theta, phi, exported_gaze.gaze_timestamp)
 
     time = exported_gaze.gaze_timestamp[:-1] - exported_gaze.gaze_timestamp.iloc[0]
 
     plt.figure(figsize=(16, 4))
 
     plt.subplot(1, 2, 1)
-    sphere_pos_over_time(time, {"gaze velocity": deg_per_sec}, unit="deg/sec")
+    sphere_pos_over_time(time, {"gaze velocity": deg_per_sec}, unit="deg/sec", buckets=buckets)
     plt.title("Gaze velocity over time")
 
     plt.subplot(1, 2, 2)
-    plt.hist(deg_per_sec, bins=np.logspace(-1, np.log10(500), 50))
+    counts, _ = np.histogram(deg_per_sec, bins=VELOCITY_BINS)
+    plot_velocity_histogram(counts, VELOCITY_BINS)
+
+    # Save histogram in the same directory
+    plt.savefig(os.path.join(output_dir, 'gaze_velocity_histogram.png'))
+
+
+def angular_velocity(theta, phi, timestamps):
+    """Angular gaze velocity in units per second between consecutive samples."""
+    squared_theta_diff = np.diff(theta) ** 2
+    squared_phi_diff = np.diff(phi) ** 2
+    deg_diff = np.sqrt(squared_theta_diff + squared_phi_diff)
+    ts_diff = np.diff(timestamps)
+    return deg_diff / ts_diff
+
+
+def plot_velocity_histogram(counts, bins):
+    # Draw precomputed counts, so the in-memory and streaming modes produce the same plot
+    plt = plotting.pyplot()
+    plt.hist(bins[:-1], bins=bins, weights=counts)
     plt.title("Gaze velocity histogram")
     plt.xlabel("Gaze velocity [deg/sec]")
 
-    # Save histogram in the same directory
+
+class RunningStats:
+    """
+    Count, mean, variance, min and max of a stream of values, merged chunk by chunk with
+    Chan's parallel update so memory stays constant. Non-finite values are only counted.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.non_finite = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        finite = values[np.isfinite(values)]
+        self.non_finite += len(values) - len(finite)
+        if len(finite) == 0:
+            return
+
+        count = len(finite)
+        mean = finite.mean()
+        m2 = np.square(finite - mean).sum()
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, finite.min())
+        self.max = max(self.max, finite.max())
+
+    def as_dict(self):
+        std = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+        return {'count': self.count, 'non_finite': self.non_finite, 'mean': self.mean,
+                'std': std, 'min': self.min, 'max': self.max}
+
+
+def stream_gaze_velocity(file_path, chunk_size=100_000, bins=VELOCITY_BINS):
+    """
+    Compute the gaze velocity histogram and running statistics by reading the gaze export in
+    blocks of chunk_size rows. The last valid sample of each block is carried into the next one
+    for the differences, so the counts are identical to the in-memory gaze_velocity_calculation.
+    """
+    counts = np.zeros(len(bins) - 1, dtype=np.int64)
+    stats = RunningStats()
+    carry = None
+
+    for chunk in export_cache.iter_export_chunks(file_path, export_cache.GAZE_POSITIONS, chunk_size):
+        chunk = flip_negative_z(chunk.dropna())
+        if chunk.empty:
+            continue
+        _, theta, phi = cart_to_spherical(chunk, apply_rad2deg=True)
+        theta, phi, timestamps = theta.to_numpy(), phi.to_numpy(), chunk.gaze_timestamp.to_numpy()
+        if carry is not None:
+            theta, phi, timestamps = (np.concatenate([previous, current])
+                                      for previous, current in zip(carry, (theta, phi, timestamps)))
+
+        deg_per_sec = angular_velocity(theta, phi, timestamps)
+        counts += np.histogram(deg_per_sec, bins=bins)[0]
+        stats.update(deg_per_sec)
+        carry = (theta[-1:], phi[-1:], timestamps[-1:])
+
+    return counts, stats
+
+
+def stream_velocity_histogram(file_path, output_dir, chunk_size=100_000):
+    plt = plotting.pyplot()
+    print('Constructing Gaze Velocity Histogram (streaming)')
+    counts, stats = stream_gaze_velocity(file_path, chunk_size)
+    for name, value in stats.as_dict().items():
+        print(f"{name}: {value}")
+
+    plt.figure(figsize=(8, 4))
+    plot_velocity_histogram(counts, VELOCITY_BINS)
     plt.savefig(os.path.join(output_dir, 'gaze_velocity_histogram.png'))
 
 
-def plot_on_sphere(r, theta, phi, unit="radians"):
+def sample_velocity(exported_gaze):
+    """
+    Angular velocity in deg/sec at every gaze sample: the velocity of the step that ends at the
+    sample, and for the first sample the velocity of the step that starts at it.
+    """
+    _, theta, phi = cart_to_spherical(exported_gaze, apply_rad2deg=True)
+    deg_per_sec = angular_velocity(theta.to_numpy(), phi.to_numpy(), exported_gaze.gaze_timestamp.to_numpy())
+    return np.concatenate([deg_per_sec[:1], deg_per_sec]) if len(deg_per_sec) else np.full(len(exported_gaze), np.nan)
+
+
+def _runs(mask):
+    """Start and exclusive end indices of every run of True values in a boolean array."""
+    edges = np.diff(np.concatenate([[0], mask.view(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _reduce_segments(ufunc, values, starts, ends):
+    # reduceat over interleaved (start, end) pairs reduces values[start:end] at the even positions;
+    # the trailing padding row keeps end == len(values) a valid index
+    padded = np.concatenate([values, values[..., :1]], axis=-1)
+    bounds = np.column_stack([starts, ends]).ravel()
+    return ufunc.reduceat(padded, bounds, axis=-1)[..., ::2]
+
+
+def detect_fixations(exported_gaze, velocity_threshold=30.0, min_duration=60.0, max_duration=None,
+                     max_gap=0.075, max_merge_angle=0.5, min_confidence=0.6, velocity=None):
+    """
+    Velocity-threshold (I-VT) fixation detection over a gaze export as returned by load_process.
+
+    Samples slower than velocity_threshold deg/sec with at least min_confidence are fixation
+    samples; each run of them is a fixation candidate. Consecutive candidates separated by at
+    most max_gap seconds whose mean gaze directions are at most max_merge_angle degrees apart
+    are merged, including the samples between them. Fixations shorter than min_duration or
+    longer than max_duration milliseconds are dropped. Pass a precomputed sample_velocity as
+    velocity to sweep thresholds without recomputing it.
+
+    Returns a DataFrame with the columns of Pupil Player's fixations.csv. Dispersion is the
+    largest angle in degrees between a sample's gaze direction and the fixation's mean direction.
+    """
+    timestamps = exported_gaze.gaze_timestamp.to_numpy()
+    if velocity is None:
+        velocity = sample_velocity(exported_gaze)
+    is_fixation = (velocity < velocity_threshold) & (exported_gaze.confidence.to_numpy() >= min_confidence)
+    starts, ends = _runs(is_fixation)
+
+    # Per-sample quantities are stored one row per column, so the per-fixation reductions run along rows
+    gaze_points = exported_gaze[["gaze_point_3d_x", "gaze_point_3d_y", "gaze_point_3d_z"]].to_numpy(np.float64).T
+    directions = gaze_points / np.sqrt(np.square(gaze_points).sum(axis=0))
+
+    if len(starts) > 1:
+        run_directions = _reduce_segments(np.add, directions, starts, ends)
+        run_directions /= np.sqrt(np.square(run_directions).sum(axis=0))
+        cosines = (run_directions[:, :-1] * run_directions[:, 1:]).sum(axis=0)
+        angles = np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+        gaps = timestamps[starts[1:]] - timestamps[ends[:-1] - 1]
+        merge = (gaps <= max_gap) & (angles <= max_merge_angle)
+        # A run that is not merged into its predecessor starts a new fixation
+        keep_start = np.concatenate([[True], ~merge])
+        keep_end = np.concatenate([~merge, [True]])
+        starts, ends = starts[keep_start], ends[keep_end]
+
+    durations = (timestamps[ends - 1] - timestamps[starts]) * 1000
+    keep = durations >= min_duration
+    if max_duration is not None:
+        keep &= durations <= max_duration
+    starts, ends, durations = starts[keep], ends[keep], durations[keep]
+
+    # Member samples of every fixation, laid out fixation after fixation
+    counts = ends - starts
+    offsets = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(starts)), counts)
+    samples = np.arange(counts.sum()) + np.repeat(starts - offsets, counts)
+
+    columns = np.vstack([exported_gaze[["norm_pos_x", "norm_pos_y", "confidence"]].to_numpy(np.float64).T,
+                         gaze_points, directions])[:, samples]
+    means = np.add.reduceat(columns, offsets, axis=1) / counts if len(starts) else np.empty((9, 0))
+
+    mean_directions = means[6:] / np.sqrt(np.square(means[6:]).sum(axis=0))
+    sample_cosines = (columns[6:] * mean_directions[:, owner]).sum(axis=0)
+    sample_angles = np.degrees(np.arccos(np.clip(sample_cosines, -1.0, 1.0)))
+    dispersion = np.maximum.reduceat(sample_angles, offsets) if len(starts) else np.empty(0)
+
+    world_index = exported_gaze.world_index.to_numpy()
+    return pd.DataFrame({
+        "id": np.arange(len(starts)),
+        "start_timestamp": timestamps[starts],
+        "duration": durations,
+        "start_frame_index": world_index[starts],
+        "end_frame_index": world_index[ends - 1],
+        "norm_pos_x": means[0],
+        "norm_pos_y": means[1],
+        "dispersion": dispersion,
+        "confidence": means[2],
+        "method": "ivt",
+        "gaze_point_3d_x": means[3],
+        "gaze_point_3d_y": means[4],
+        "gaze_point_3d_z": means[5],
+    })
+
+
+def plot_on_sphere(r, theta, phi, unit="radians", max_points=None):
+    plt = plotting.pyplot()
+    if max_points and len(r) > max_points:
+        # Evenly spaced subsample; a 3D scatter can not show more points than this anyway
+        keep = np.linspace(0, len(r) - 1, max_points).astype(int)
+        r, theta, phi = (np.asarray(values)[keep] for values in (r, theta, phi))
+
     fig = plt.figure(figsize=(10, 8))
     ax = fig.add_subplot(111, projection='3d')
 
@@ -122,15 +385,43 @@ def plot_on_sphere(r, theta, phi, unit="radians"):
 def main():
     parser = argparse.ArgumentParser(description='Generate Gaze Velocity')
     parser.add_argument('gaze_positions', help='Path to the gaze positions CSV file')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the CSV in chunks with constant memory; only the velocity histogram is produced')
+    parser.add_argument('--chunk-size', type=int, default=100_000, help='Rows read per chunk with --stream')
+    parser.add_argument('--fast-plots', action='store_true',
+                        help='Aggregate large exports before plotting: density image, min/max decimated '
+                             'time series and a subsampled 3D view')
+    parser.add_argument('--detect-fixations', metavar='OUTPUT_CSV',
+                        help='Detect fixations with a velocity threshold and write them in the fixations.csv format')
+    parser.add_argument('--velocity-threshold', type=float, default=30.0,
+                        help='Fixation samples are slower than this [deg/sec]')
+    parser.add_argument('--min-duration', type=float, default=60.0, help='Shortest fixation kept [ms]')
+    parser.add_argument('--max-duration', type=float, help='Longest fixation kept [ms]')
+    parser.add_argument('--max-gap', type=float, default=0.075, help='Longest gap between merged fixations [sec]')
+    parser.add_argument('--max-merge-angle', type=float, default=0.5,
+                        help='Largest angle between merged fixations [deg]')
+    parser.add_argument('--min-confidence', type=float, default=0.6, help='Lowest confidence of a fixation sample')
     args = parser.parse_args()
 
     # Get the output directory from the gaze file path
     output_dir = os.path.dirname(args.gaze_positions)
 
+    if args.stream:
+        stream_velocity_histogram(args.gaze_positions, output_dir, args.chunk_size)
+        return
+
+    if args.detect_fixations:
+        fixations = detect_fixations(export_cache.load_gaze_positions(args.gaze_positions).dropna().pipe(flip_negative_z),
+                                     args.velocity_threshold, args.min_duration, args.max_duration,
+                                     args.max_gap, args.max_merge_angle, args.min_confidence)
+        fixations.to_csv(args.detect_fixations, index=False)
+        print(f"{len(fixations)} fixations written to {args.detect_fixations}")
+        return
+
     gaze_data = load_process(args.gaze_positions)
-    gaze_velocity_calculation(gaze_data, output_dir)
+    gaze_velocity_calculation(gaze_data, output_dir, fast=args.fast_plots)
     r, theta, phi = cart_to_spherical(gaze_data)
-    plot_on_sphere(r, theta, phi)
+    plot_on_sphere(r, theta, phi, max_points=SPHERE_POINTS if args.fast_plots else None)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+"""
+A heatmap store keeps the per-frame heatmap grids of a render in a directory, so later analyses
+can read any frame range without decoding video or recomputing kernels:
+
+    meta.json           grid shape, dtype, chunking and the frame size the grids were made for
+    frame_index.npy     video frame index of every stored grid, ascending
+    scale.npy           per-grid maximum, used to undo the quantisation
+    chunk_00000.npz     chunk_frames consecutive grids, compressed
+    chunk_00000.npy     ... or uncompressed, so they can be memory-mapped
+
+Every grid is divided by its maximum and stored as uint8 (rounded to 1/255) or float16, which
+keeps the relative detail the colour map shows at 1/8 or 1/4 of the float64 size. Frames
+without gaze have no grid.
+"""
+STORE_VERSION = 1
+GRID_DTYPES = ('uint8', 'float16')
+
+
+def _chunk_path(path, chunk, compress):
+    return os.path.join(path, f"chunk_{chunk:05d}.{'npz' if compress else 'npy'}")
+
+
+class HeatmapStoreWriter:
+    """Appends heatmap grids in frame order and writes them chunk by chunk; close() finishes the store."""
+
+    def __init__(self, path, dtype='uint8', chunk_frames=256, compress=True):
+        if dtype not in GRID_DTYPES:
+            raise ValueError(f"Unsupported grid dtype {dtype}, use one of {', '.join(GRID_DTYPES)}")
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = chunk_frames
+        self.compress = compress
+        self.grid_shape = None
+        self.frame_size = None
+
+    def open(self, grid_shape, frame_size):
+        os.makedirs(self.path, exist_ok=True)
+        # Remove a previous store; meta.json goes first so it is never paired with new chunks
+        for name in ['meta.json', 'frame_index.npy', 'scale.npy', 'chunk_*.np[yz]']:
+            for old_path in glob.glob(os.path.join(self.path, name)):
+                os.remove(old_path)
+
+        self.grid_shape = tuple(grid_shape)
+        self.frame_size = tuple(frame_size)
+        self.chunk = np.empty((self.chunk_frames,) + self.grid_shape, dtype=self.dtype)
+        self.scratch = np.empty(self.grid_shape)
+        self.filled = 0
+        self.chunks_written = 0
+        self.frame_indices = []
+        self.scales = []
+
+    def append(self, frame_idx, grid, gain=1.0):
+        """Store the grid of a frame; grid holds the heatmap multiplied by gain, which is divided out."""
+        # Trails that subtract old frames can leave tiny negative residue, which is stored as 0
+        peak = max(float(grid.max()), 0.0)
+        if peak > 0:
+            np.multiply(grid, (255.0 if self.dtype == np.uint8 else 1.0) / peak, out=self.scratch)
+        else:
+            self.scratch.fill(0)
+        if self.dtype == np.uint8:
+            np.rint(self.scratch, out=self.scratch)
+        np.clip(self.scratch, 0, None, out=self.scratch)
+        np.copyto(self.chunk[self.filled], self.scratch, casting='unsafe')
+
+        self.frame_indices.append(frame_idx)
+        self.scales.append(peak / gain)
+        self.filled += 1
+        if self.filled == self.chunk_frames:
+            self._flush()
+
+    def _flush(self):
+        if not self.filled:
+            return
+        chunk_path = _chunk_path(self.path, self.chunks_written, self.compress)
+        if self.compress:
+            np.savez_compressed(chunk_path, grids=self.chunk[:self.filled])
+        else:
+            np.save(chunk_path, self.chunk[:self.filled])
+        self.chunks_written += 1
+        self.filled = 0
+
+    def close(self):
+        self._flush()
+        np.save(os.path.join(self.path, 'frame_index.npy'), np.asarray(self.frame_indices, dtype=np.int64))
+        np.save(os.path.join(self.path, 'scale.npy'), np.asarray(self.scales, dtype=np.float64))
+        meta = {
+            'version': STORE_VERSION,
+            'grid_shape': self.grid_shape,
+            'frame_size': self.frame_size,
+            'dtype': self.dtype.name,
+            'chunk_frames': self.chunk_frames,
+            'compress': self.compress,
+            'grids': len(self.frame_indices),
+        }
+        # meta.json is written last, so a store with meta.json is complete
+        with open(os.path.join(self.path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+
+class HeatmapStore:
+    """Reads the grids of a heatmap store by video frame index."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported heatmap store version {meta['version']}")
+
+        self.grid_shape = tuple(meta['grid_shape'])
+        self.frame_size = tuple(meta['frame_size'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunk_frames = meta['chunk_frames']
+        self.compress = meta['compress']
+        self.frame_index = np.load(os.path.join(path, 'frame_index.npy'))
+        self.scale = np.load(os.path.join(path, 'scale.npy'))
+        self.cached_chunk = (None, None)
+
+    def __len__(self):
+        return len(self.frame_index)
+
+    def chunk(self, chunk):
+        """Return the stored (quantised) grids of one chunk, memory-mapped when uncompressed."""
+        if not self.compress:
+            return np.load(_chunk_path(self.path, chunk, False), mmap_mode='r')
+        if self.cached_chunk[0] != chunk:
+            with np.load(_chunk_path(self.path, chunk, True)) as chunk_file:
+                self.cached_chunk = (chunk, chunk_file['grids'])
+        return self.cached_chunk[1]
+
+    def read(self, start=None, stop=None, dtype=np.float32):
+        """
+        Return (frame_indices, grids) for the stored frames in [start, stop), with the grids scaled
+        back to the heatmap's values. Only the chunks overlapping the range are read.
+        """
+        first = 0 if start is None else np.searchsorted(self.frame_index, start, side='left')
+        last = len(self) if stop is None else np.searchsorted(self.frame_index, stop, side='left')
+        grids = np.empty((max(last - first, 0),) + self.grid_shape, dtype=dtype)
+
+        position = first
+        while position < last:
+            chunk, offset = divmod(position, self.chunk_frames)
+            count = min(self.chunk_frames - offset, last - position)
+            grids[position - first:position - first + count] = self.chunk(chunk)[offset:offset + count]
+            position += count
+
+        factors = self.scale[first:last] / (255.0 if self.dtype == np.uint8 else 1.0)
+        grids *= factors.astype(dtype)[:, None, None]
+        return self.frame_index[first:last], grids
+
+    def grid(self, frame_idx, dtype=np.float32):
+        """Return the grid of one video frame, or None if it had no gaze."""
+        frame_indices, grids = self.read(frame_idx, frame_idx + 1, dtype)
+        return grids[0] if len(grids) else None
@@ -0,0 +1,218 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sqlite3
+import statistics
+import time
+
+import pandas as pd
+
+from ffmpeg_scheduler import Job, run_jobs
+
+"""
+Persistent cache of video metadata in an SQLite database, keyed by path, size and modification
+time. A file is probed again only when it changes. Probes that fail are cached for
+FAILED_PROBE_TTL seconds, so a broken file is reported from the cache instead of being probed on
+every run, yet a file that failed for a passing reason (a busy NFS server, a file still being
+copied with its final size) is retried later. Misses are probed with ffprobe through the ffmpeg
+scheduler, many at a time.
+
+The database defaults to ~/.cache/media_metadata.sqlite and can be moved with the
+MEDIA_METADATA_DB environment variable; keep it on a local disk when the videos are on NFS.
+"""
+DEFAULT_DB_PATH = os.environ.get('MEDIA_METADATA_DB',
+                                 os.path.join(os.path.expanduser('~'), '.cache', 'media_metadata.sqlite'))
+FIELDS = ['duration', 'fps', 'width', 'height', 'codec', 'keyframe_interval']
+
+# Bump when the probe or parsing changes, so cached entries are probed again
+METADATA_VERSION = 1
+
+# Seconds a failed probe is reported from the cache before the file is probed again
+FAILED_PROBE_TTL = 24 * 3600
+
+# Seconds of packets read to measure the keyframe interval; GOPs longer than this report None
+KEYFRAME_WINDOW = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    duration REAL,
+    fps REAL,
+    width INTEGER,
+    height INTEGER,
+    codec TEXT,
+    keyframe_interval REAL,
+    error TEXT,
+    probed_at REAL NOT NULL
+)
+"""
+
+
+def probe_command(path, keyframe_window=KEYFRAME_WINDOW):
+    return ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', f"%+{keyframe_window}",
+            '-show_entries', 'format=duration:stream=codec_name,width,height,avg_frame_rate,duration:packet=pts_time,flags',
+            '-of', 'json', path]
+
+
+def _frame_rate(rate):
+    numerator, _, denominator = (rate or '').partition('/')
+    try:
+        return float(numerator) / float(denominator or 1) or None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_probe(output):
+    """Metadata of a video from the JSON output of probe_command."""
+    probe = json.loads(output)
+    streams = probe.get('streams') or [{}]
+    stream = streams[0]
+    duration = probe.get('format', {}).get('duration', stream.get('duration'))
+    if duration is None:
+        raise ValueError('No duration in ffprobe output')
+
+    keyframes = sorted(float(packet['pts_time']) for packet in probe.get('packets', [])
+                       if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A'))
+    intervals = [b - a for a, b in zip(keyframes, keyframes[1:])]
+    return {
+        'duration': float(duration),
+        'fps': _frame_rate(stream.get('avg_frame_rate')),
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'codec': stream.get('codec_name'),
+        'keyframe_interval': statistics.median(intervals) if intervals else None,
+    }
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns, None
+    except OSError as e:
+        return None, None, e
+
+
+class MediaMetadataCache:
+    """The metadata database; get() answers from it and probes what is missing or out of date."""
+
+    def __init__(self, db_path=None, failed_probe_ttl=FAILED_PROBE_TTL):
+        self.db_path = db_path or DEFAULT_DB_PATH
+        self.failed_probe_ttl = failed_probe_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.db_path, timeout=60)
+        self.connection.execute(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _lookup(self, keys):
+        rows = {}
+        paths = list(keys)
+        retry_before = time.time() - self.failed_probe_ttl
+        # Stay below SQLite's limit on query parameters
+        for start in range(0, len(paths), 500):
+            batch = paths[start:start + 500]
+            query = (f"SELECT path, size, mtime_ns, version, error, probed_at, {', '.join(FIELDS)} FROM media "
+                     f"WHERE path IN ({', '.join('?' * len(batch))})")
+            for path, size, mtime_ns, version, error, probed_at, *values in self.connection.execute(query, batch):
+                if (size, mtime_ns) != keys[path] or version != METADATA_VERSION:
+                    continue
+                if error is not None and probed_at < retry_before:
+                    continue
+                rows[path] = (dict(zip(FIELDS, values)), error)
+        return rows
+
+    def get(self, paths, max_concurrency=None, timeout=60, retries=1, keyframe_window=KEYFRAME_WINDOW):
+        """
+        Return the metadata dict of every path in order, None where the file is missing or could not
+        be probed. Files are stat'ed in a thread pool, as stat is the slow part on network mounts.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        unique_paths = list(dict.fromkeys(paths))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=32) as pool:
+            stats = dict(zip(unique_paths, pool.map(_stat, unique_paths)))
+
+        for path, (_, _, error) in stats.items():
+            if error is not None:
+                print(f"Error loading {path}: {error}")
+        keys = {path: (size, mtime_ns) for path, (size, mtime_ns, error) in stats.items() if error is None}
+        results = self._lookup(keys)
+
+        missing = [path for path in keys if path not in results]
+        if missing:
+            print(f"Probing {len(missing)} of {len(keys)} videos")
+            jobs = [Job(probe_command(path, keyframe_window), name=path) for path in missing]
+            rows = []
+            for path, result in zip(missing, run_jobs(jobs, max_concurrency, timeout, retries)):
+                metadata, error = dict.fromkeys(FIELDS), result.error
+                if result.ok:
+                    try:
+                        metadata = parse_probe(result.stdout)
+                    except (ValueError, KeyError) as e:
+                        error = f"Unreadable ffprobe output: {e}"
+                results[path] = (metadata, error)
+                # Timeouts and a missing ffprobe say nothing about the file, so only finished probes are kept
+                if result.returncode is not None and result.returncode >= 0:
+                    rows.append((path, *keys[path], METADATA_VERSION, *(metadata[field] for field in FIELDS), error,
+                                 time.time()))
+            with self.connection:
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO media (path, size, mtime_ns, version, {', '.join(FIELDS)}, error, "
+                    f"probed_at) VALUES ({', '.join('?' * (len(FIELDS) + 6))})", rows)
+
+        metadata = []
+        for path in paths:
+            entry, error = results.get(path, (None, None))
+            if error is not None:
+                print(f"Error probing {path}: {error}")
+                entry = None
+            metadata.append(entry)
+        return metadata
+
+
+def load_metadata(paths, db_path=None, **probe_options):
+    """Metadata of every path in order, from the cache at db_path; see MediaMetadataCache.get."""
+    with MediaMetadataCache(db_path) as cache:
+        return cache.get(paths, **probe_options)
+
+
+def load_durations(paths, db_path=None, **probe_options):
+    """Duration of every path in seconds, in order; None where it could not be read."""
+    return [None if entry is None else entry['duration'] for entry in load_metadata(paths, db_path, **probe_options)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill the media metadata cache and optionally export it.')
+    parser.add_argument('paths', nargs='*', help='Video files')
+    parser.add_argument('--list', action='append', default=[],
+                        help='Headerless CSV with video paths in its first column, e.g. a candidate pool')
+    parser.add_argument('--db', help=f"Metadata database (default: {DEFAULT_DB_PATH})")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of ffprobe processes run at once')
+    parser.add_argument('--output', help='Write the metadata of all paths to this CSV')
+    args = parser.parse_args()
+
+    paths = list(args.paths)
+    for list_path in args.list:
+        paths.extend(pd.read_csv(list_path, header=None)[0].tolist())
+
+    metadata = load_metadata(paths, args.db, max_concurrency=args.jobs)
+    print(f"{sum(entry is not None for entry in metadata)} of {len(paths)} videos have metadata")
+    if args.output:
+        table = pd.DataFrame([{'path': path, **(entry or dict.fromkeys(FIELDS))} for path, entry in zip(paths, metadata)],
+                             columns=['path'] + FIELDS).astype({'width': 'Int64', 'height': 'Int64'})
+        table.to_csv(args.output, index=False)
+        print(f"Metadata written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import functools
+import os
+
+"""
+Matplotlib and seaborn take most of the startup time of the analysis scripts, so they are only
+imported by the code paths that draw something. The scripts only write image files, so the
+non-interactive Agg backend is used unless MPLBACKEND selects another one.
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def pyplot():
+    """Import and return matplotlib.pyplot, selecting the backend and seaborn theme on first use."""
+    import matplotlib
+    if 'MPLBACKEND' not in os.environ:
+        matplotlib.use('Agg')
+
+    import seaborn as sns
+    sns.set(context="notebook", style="whitegrid", font_scale=1.2)
+
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def seaborn():
+    pyplot()
+    import seaborn as sns
+    return sns
@@ -3,65 +3,118 @@ import pathlib
 
 import numpy as np
 import pandas as pd
-import seaborn as sns
+import argparse
 
-sns.set(context="notebook", style="whitegrid", font_scale=1.2)
+import export_cache
+import plotting
+
+# Pupil samples below this confidence are left out of every mean
+MIN_CONFIDENCE = 0.8
 
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
-import argparse
 
 """
-The pupil_calculation function takes two arguments:
-    - pupil_positions_file: a csv file containing the pupil positions for each frame of the video.
-    - fixations_file: a csv file containing the fixation points and their durations.
+The load_pupil_samples function reads the pupil samples of the 3D detector.
 
 :param pupil_positions_file: Specify the file path of the pupil positions data
-:param fixations_file: Specify the file that contains the fixations
-:return: A list of lists
+:return: A DataFrame with the pupil_timestamp, diameter_3d and confidence columns
 """
-def pupil_calculation(pupil_positions_file, fixations_file):
-    pupil_positions_file = pupil_positions_file
-    fixations_file = fixations_file
+def load_pupil_samples(pupil_positions_file):
+    pupil_positions = export_cache.load_pupil_positions(pupil_positions_file)
+    pupil_positions = pupil_positions[pupil_positions.method != "2d c++"]
+    return pupil_positions[["pupil_timestamp", "diameter_3d", "confidence"]]
+
 
-    print("Necessary files:")
-    print(pupil_positions_file)
-    print(fixations_file)
+"""
+The unique_fixations function keeps the first row of every fixation id, in id order (what
+groupby("id") iterated over).
 
-    pupil_positions = pd.read_csv(pupil_positions_file)
-    fixations = pd.read_csv(fixations_file)
+:param fixations: A fixations DataFrame
+:return: The fixations with one row per id
+"""
+def unique_fixations(fixations):
+    return fixations[fixations.id.notna()].drop_duplicates("id").sort_values("id", kind="stable")
 
-    pupil_positions = pupil_positions[pupil_positions.method != "2d c++"]
 
-    pupil_positions = pupil_positions[["pupil_timestamp", "diameter_3d", "confidence"]]
+"""
+The pupil_calculation function takes two arguments:
+    - pupil_positions_file: a csv file containing the pupil positions for each frame of the video.
+    - fixations_file: a csv file containing the fixation points and their durations.
+
+Every fixation is matched to the high-confidence pupil samples between its start and end in one
+vectorized pass: the samples are sorted by timestamp, each fixation's bounds are located with
+searchsorted, and the diameters are summed per fixation with np.add.reduceat.
+
+:param pupil_positions_file: Specify the file path of the pupil positions data
+:param fixations_file: Specify the file that contains the fixations
+:param verbose: Print the input files and tables, set to False for a quiet run
+:return: A list of [fixation id, mean diameter_3d] pairs, ordered by fixation id
+"""
+def pupil_calculation(pupil_positions_file, fixations_file, verbose=True):
+    if verbose:
+        print("Necessary files:")
+        print(pupil_positions_file)
+        print(fixations_file)
+
+    pupil_positions = load_pupil_samples(pupil_positions_file)
+    fixations = export_cache.load_fixations(fixations_file)
     fixations = fixations[["id", "start_timestamp", "duration"]]
 
-    pupil_positions.info()
-    print()
-    fixations.info()
+    if verbose:
+        pupil_positions.info()
+        print()
+        fixations.info()
 
-    MIN_CONFIDENCE = 0.8
+    first_fixations = unique_fixations(fixations)
+    if verbose:
+        print(first_fixations)
 
-    results = []
+    mean_diameters = mean_in_windows(
+        pupil_positions.pupil_timestamp.values,
+        pupil_positions.diameter_3d.values,
+        first_fixations.start_timestamp.values,
+        first_fixations.start_timestamp.values + first_fixations.duration.values / 1000,
+        mask=pupil_positions.confidence.values >= MIN_CONFIDENCE,
+    )
 
-    for _, fixations in fixations.groupby("id"):
-        first_fixation = fixations.iloc[0]
-        print(first_fixation)
+    return [[fixation_id, mean_diameter] for fixation_id, mean_diameter in zip(first_fixations.id, mean_diameters)]
 
-        fixation_id = first_fixation.id
-        fixation_start = first_fixation.start_timestamp
-        fixation_end = fixation_start + first_fixation.duration / 1000
 
-        mask_after_start = fixation_start <= pupil_positions.pupil_timestamp
-        mask_before_end = pupil_positions.pupil_timestamp <= fixation_end
-        mask_high_confidence = pupil_positions.confidence >= MIN_CONFIDENCE
+"""
+The mean_in_windows function returns, for every closed window [starts[i], ends[i]], the mean of
+the non-NaN values whose timestamp falls inside it, or NaN for windows without samples.
+
+:param timestamps: Sample timestamps, in any order
+:param values: Sample values aligned with timestamps
+:param starts: Window start timestamps
+:param ends: Window end timestamps
+:param mask: Optional boolean array selecting the samples to use
+:return: An array with one mean per window
+"""
+def mean_in_windows(timestamps, values, starts, ends, mask=None):
+    keep = ~np.isnan(values) & ~np.isnan(timestamps)
+    if mask is not None:
+        keep &= mask
+    timestamps = timestamps[keep]
+    values = values[keep]
+
+    order = np.argsort(timestamps, kind="stable")
+    timestamps = timestamps[order]
+    values = values[order]
 
-        pupil_positions_during_fixation = pupil_positions[mask_after_start & mask_before_end & mask_high_confidence]
-        diameter_3d_during_fixation = pupil_positions_during_fixation.diameter_3d
+    lower = np.searchsorted(timestamps, starts, side="left")
+    upper = np.searchsorted(timestamps, ends, side="right")
+    counts = upper - lower
 
-        results.append([fixation_id, diameter_3d_during_fixation.mean()])
+    # reduceat over interleaved (lower, upper) pairs sums values[lower:upper] at the even positions;
+    # the trailing zero keeps upper == len(values) a valid index
+    padded = np.append(values, 0.0)
+    bounds = np.column_stack([lower, upper]).ravel()
+    sums = np.add.reduceat(padded, bounds)[::2] if len(bounds) else np.empty(0)
 
-    return results
+    means = np.full(len(counts), np.nan)
+    has_samples = counts > 0
+    means[has_samples] = sums[has_samples] / counts[has_samples]
+    return means
 
 
 """
@@ -80,15 +133,18 @@ def main():
     parser.add_argument('pupil_positions_file', help='Path to the pupil_positions_file CSV ')
     parser.add_argument('fixations_file', help='Path to the fixations_file CSV file')
     parser.add_argument('output_file_suffix', help='output file directory name')
+    parser.add_argument('--quiet', action='store_true', help='Do not print the input files and tables')
 
     args = parser.parse_args()
     fixation = os.path.dirname(args.pupil_positions_file)
     fixation = fixation + "/fixations.csv"
 
 
-    mean_diameter_3d_by_fixation = pd.DataFrame(pupil_calculation(args.pupil_positions_file, fixation),
+    mean_diameter_3d_by_fixation = pd.DataFrame(pupil_calculation(args.pupil_positions_file, fixation,
+                                                                  verbose=not args.quiet),
                                                 columns=["id", "mean_pupil_diameter_3d"])
 
+    plt = plotting.pyplot()
     plt.scatter(mean_diameter_3d_by_fixation.id, mean_diameter_3d_by_fixation.mean_pupil_diameter_3d)
     max_diameter = mean_diameter_3d_by_fixation['mean_pupil_diameter_3d'].max()
     min_diameter = mean_diameter_3d_by_fixation['mean_pupil_diameter_3d'].min()
@@ -0,0 +1,165 @@
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import re
+import traceback
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import export_cache
+import pupil_Analysis
+
+REQUIRED_FILES = ('pupil_positions.csv', 'fixations.csv')
+TABLE_COLUMNS = ['subject', 'label', 'recording', 'level', 'fixation_id', 'statistic', 'value']
+
+# Bump when the statistics change, so cached tables are recomputed
+STATS_VERSION = 1
+
+
+def describe_recording(root, export_dir):
+    """Subject, label and recording name of an export, taken from its path below root."""
+    recording = os.path.relpath(export_dir, root)
+    parts = recording.split(os.sep)
+    subject = next((part for part in parts if re.fullmatch(r'subject_\d+', part)), None)
+    label = next((part for part in parts if re.fullmatch(r'label_\d+', part)), None)
+    return {'subject': subject, 'label': label, 'recording': recording}
+
+
+def recording_statistics(export_dir):
+    """
+    Pupil statistics of one export in long format: the mean pupil diameter and duration of every
+    fixation, and per-clip statistics over all high-confidence samples and fixations.
+    """
+    samples = pupil_Analysis.load_pupil_samples(os.path.join(export_dir, 'pupil_positions.csv'))
+    fixations = pupil_Analysis.unique_fixations(export_cache.load_fixations(os.path.join(export_dir, 'fixations.csv')))
+
+    timestamps = samples.pupil_timestamp.to_numpy()
+    diameters = samples.diameter_3d.to_numpy(np.float64)
+    confident = samples.confidence.to_numpy() >= pupil_Analysis.MIN_CONFIDENCE
+    starts = fixations.start_timestamp.to_numpy()
+    durations = fixations.duration.to_numpy()
+    fixation_means = pupil_Analysis.mean_in_windows(timestamps, diameters, starts, starts + durations / 1000,
+                                                    mask=confident)
+
+    fixation_rows = pd.DataFrame({
+        'fixation_id': fixations.id.to_numpy(),
+        'mean_pupil_diameter_3d': fixation_means,
+        'duration': durations,
+    }).melt(id_vars='fixation_id', var_name='statistic', value_name='value')
+    fixation_rows.insert(0, 'level', 'fixation')
+
+    valid = pd.Series(diameters[confident]).dropna()
+    clip = {
+        'n_samples': len(valid),
+        'mean_pupil_diameter_3d': valid.mean(),
+        'std_pupil_diameter_3d': valid.std(),
+        'median_pupil_diameter_3d': valid.median(),
+        'n_fixations': len(fixations),
+        'mean_fixation_pupil_diameter_3d': pd.Series(fixation_means).mean(),
+        'total_fixation_duration': durations.sum(),
+    }
+    clip_rows = pd.DataFrame({'level': 'clip', 'fixation_id': np.nan,
+                              'statistic': list(clip), 'value': list(clip.values())})
+    return pd.concat([fixation_rows, clip_rows], ignore_index=True)
+
+
+def _cache_path(export_dir):
+    key = {
+        'version': STATS_VERSION,
+        'min_confidence': pupil_Analysis.MIN_CONFIDENCE,
+        'sources': [export_cache.source_key(os.path.join(export_dir, name)) for name in REQUIRED_FILES],
+    }
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:10]
+    return os.path.join(export_dir, export_cache.CACHE_DIR_NAME, f"pupil_statistics.{digest}.csv")
+
+
+def load_cached_statistics(export_dir):
+    """Return the cached statistics of an export, or None if its inputs changed since they were computed."""
+    path = _cache_path(export_dir)
+    return pd.read_csv(path) if os.path.isfile(path) else None
+
+
+def process_recording(export_dir, use_cache=True):
+    """Compute and cache the statistics of one export in a worker process; returns (table, error message)."""
+    try:
+        statistics = recording_statistics(export_dir)
+    except Exception:
+        return None, traceback.format_exc()
+
+    if use_cache:
+        path = _cache_path(export_dir)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            for stale_path in glob.glob(os.path.join(os.path.dirname(path), 'pupil_statistics.*.csv')):
+                os.remove(stale_path)
+            statistics.to_csv(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Warning: could not cache the statistics of {export_dir}: {e}")
+    return statistics, None
+
+
+def subject_number(subject):
+    """Number in a subject name such as subject_12, for sorting subjects numerically; -1 without one."""
+    match = re.search(r'\d+', subject) if isinstance(subject, str) else None
+    return int(match.group()) if match else -1
+
+
+def run_batch(root, max_workers=None, force=False):
+    """
+    Collect the pupil statistics of every export under root into one long table, computing the
+    exports without an up-to-date cache in a process pool. Returns the table and the failures.
+    """
+    export_dirs = export_cache.find_export_dirs(root, REQUIRED_FILES)
+    tables, pending, failures = [], [], []
+    for export_dir in export_dirs:
+        cached = None if force else load_cached_statistics(export_dir)
+        if cached is None:
+            pending.append(export_dir)
+        else:
+            tables.append(cached.assign(**describe_recording(root, export_dir)))
+    print(f"{len(export_dirs)} recordings, {len(tables)} cached, processing {len(pending)}")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(process_recording, export_dir): export_dir for export_dir in pending}
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            export_dir = futures[future]
+            try:
+                statistics, error = future.result()
+            except Exception as e:  # e.g. a worker process that died
+                statistics, error = None, f"Worker failed: {e}"
+            if error is None:
+                tables.append(statistics.assign(**describe_recording(root, export_dir)))
+            else:
+                print(f"Error processing {export_dir}: {error.splitlines()[-1]}")
+                failures.append({'export_dir': export_dir, 'error': error})
+
+    if not tables:
+        return pd.DataFrame(columns=TABLE_COLUMNS), failures
+    table = pd.concat(tables, ignore_index=True)[TABLE_COLUMNS]
+    table = table.sort_values(['subject', 'label', 'recording', 'level', 'fixation_id'], kind='stable',
+                              key=lambda column: column.map(subject_number) if column.name == 'subject' else column)
+    return table.reset_index(drop=True), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pupil statistics of every recording under a directory.')
+    parser.add_argument('root', help='Directory tree searched for Pupil Player exports, e.g. the experimental data')
+    parser.add_argument('--output', help='Path of the long-format CSV (default: <root>/pupil_statistics.csv)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of recordings processed at once')
+    parser.add_argument('--force', action='store_true', help='Recompute recordings even if their statistics are cached')
+    args = parser.parse_args()
+
+    table, failures = run_batch(args.root, max_workers=args.jobs, force=args.force)
+    output_path = args.output or os.path.join(args.root, 'pupil_statistics.csv')
+    table.to_csv(output_path, index=False)
+    print(f"{table.recording.nunique()} recordings, {len(failures)} failed. Statistics written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import export_cache
+import pupil_Analysis
+import pupil_batch
+
+MANIFEST_COLUMNS = ['subject', 'stimulus', 'fixation_data']
+METRICS = ['dtw', 'vector', 'direction', 'length', 'position', 'duration']
+
+# Bump when a metric changes, so cached pairs are recomputed
+SIMILARITY_VERSION = 1
+
+# Diagonal of the normalised coordinate space, the largest possible distance between fixations
+DIAGONAL = np.sqrt(2.0)
+
+
+def load_scanpath(fixation_data):
+    """Fixation positions and durations of a fixations.csv in temporal order."""
+    fixations = pupil_Analysis.unique_fixations(export_cache.load_fixations(fixation_data))
+    fixations = fixations.sort_values('start_timestamp', kind='stable')
+    return {
+        'x': fixations.norm_pos_x.to_numpy(np.float64),
+        'y': fixations.norm_pos_y.to_numpy(np.float64),
+        'duration': fixations.duration.to_numpy(np.float64),
+    }
+
+
+def accumulated_cost(cost):
+    """
+    Dynamic time warping table of a cost matrix: D[i, j] is the cheapest monotone path from
+    (0, 0) to (i, j) with right, down and diagonal steps. Row i follows from row i - 1 as
+    D[i, j] = S[j] + min over k <= j of (min(D[i-1, k-1], D[i-1, k]) - S[k-1]), with S the prefix
+    sums of cost[i], so every row is one cumulative minimum instead of a loop over columns.
+    """
+    rows, cols = cost.shape
+    table = np.empty((rows, cols))
+    previous = np.full(cols, np.inf)
+    for i in range(rows):
+        diagonal = np.concatenate([[0.0 if i == 0 else np.inf], previous[:-1]])
+        entry = np.minimum(diagonal, previous)
+        prefix = np.cumsum(cost[i])
+        table[i] = prefix + np.minimum.accumulate(entry - (prefix - cost[i]))
+        previous = table[i]
+    return table
+
+
+def warping_path(table):
+    """Backtrack the cheapest path through an accumulated cost table; returns aligned (i, j) index arrays."""
+    i, j = table.shape[0] - 1, table.shape[1] - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        else:
+            step = np.argmin([table[i - 1, j - 1], table[i - 1, j], table[i, j - 1]])
+            i, j = (i - 1, j - 1) if step == 0 else (i - 1, j) if step == 1 else (i, j - 1)
+        path.append((i, j))
+    path = np.array(path[::-1])
+    return path[:, 0], path[:, 1]
+
+
+def _distances(ax, ay, bx, by):
+    return np.hypot(ax[:, None] - bx[None, :], ay[:, None] - by[None, :])
+
+
+def compare_scanpaths(a, b):
+    """
+    Similarity of two scanpaths.
+
+    dtw is the DTW distance between the fixation positions divided by the combined length, in
+    normalised units. The other metrics follow MultiMatch: saccade vectors are aligned with the
+    cheapest monotone path over their vector differences, and the aligned pairs are compared by
+    vector difference, direction, length, start fixation position and start fixation duration.
+    Each is 1 for identical scanpaths and 0 for the largest possible difference; they are NaN
+    when a scanpath has fewer than two fixations.
+    """
+    result = dict.fromkeys(METRICS, np.nan)
+    if len(a['x']) == 0 or len(b['x']) == 0:
+        return result
+    result['dtw'] = accumulated_cost(_distances(a['x'], a['y'], b['x'], b['y']))[-1, -1] / (len(a['x']) + len(b['x']))
+    if len(a['x']) < 2 or len(b['x']) < 2:
+        return result
+
+    au, av = np.diff(a['x']), np.diff(a['y'])
+    bu, bv = np.diff(b['x']), np.diff(b['y'])
+    i, j = warping_path(accumulated_cost(_distances(au, av, bu, bv)))
+
+    angle = np.abs(np.arctan2(av[i], au[i]) - np.arctan2(bv[j], bu[j]))
+    angle = np.minimum(angle, 2 * np.pi - angle)
+    durations = np.maximum(a['duration'][i], b['duration'][j])
+    result.update({
+        'vector': 1 - np.mean(np.hypot(au[i] - bu[j], av[i] - bv[j])) / (2 * DIAGONAL),
+        'direction': 1 - np.mean(angle) / np.pi,
+        'length': 1 - np.mean(np.abs(np.hypot(au[i], av[i]) - np.hypot(bu[j], bv[j]))) / DIAGONAL,
+        'position': 1 - np.mean(np.hypot(a['x'][i] - b['x'][j], a['y'][i] - b['y'][j])) / DIAGONAL,
+        'duration': 1 - np.mean(np.abs(a['duration'][i] - b['duration'][j])
+                                / np.where(durations > 0, durations, 1)),
+    })
+    return result
+
+
+def compare_pairs(pairs):
+    """Compare a batch of (key, scanpath_a, scanpath_b) pairs in a worker process."""
+    return [(key, compare_scanpaths(a, b)) for key, a, b in pairs]
+
+
+def _pair_key(fixation_data_a, fixation_data_b):
+    key = {
+        'version': SIMILARITY_VERSION,
+        'sources': [export_cache.source_key(fixation_data_a), export_cache.source_key(fixation_data_b)],
+        'paths': [os.path.abspath(fixation_data_a), os.path.abspath(fixation_data_b)],
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _read_cached_pair(cache_dir, key):
+    try:
+        with open(os.path.join(cache_dir, f"{key}.json")) as cache_file:
+            return {name: np.nan if value is None else value for name, value in json.load(cache_file).items()}
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cached_pair(cache_dir, key, metrics):
+    path = os.path.join(cache_dir, f"{key}.json")
+    with open(path + '.tmp', 'w') as cache_file:
+        json.dump({name: None if np.isnan(value) else float(value) for name, value in metrics.items()}, cache_file)
+    os.replace(path + '.tmp', path)
+
+
+def discover_recordings(root):
+    """
+    One row per fixations.csv under root. The subject is the subject_N path component and the
+    stimulus is the rest of the path without it and without Pupil Player's exports/<nnn> suffix.
+    """
+    rows = []
+    for export_dir in export_cache.find_export_dirs(root, ('fixations.csv',)):
+        identity = pupil_batch.describe_recording(root, export_dir)
+        parts = [part for part in identity['recording'].split(os.sep) if part != identity['subject']]
+        stimulus = re.sub(r'(^|/)exports/\d+$', '', '/'.join(parts)) or '.'
+        rows.append({'subject': identity['subject'], 'stimulus': stimulus,
+                     'fixation_data': os.path.join(export_dir, 'fixations.csv')})
+    return pd.DataFrame(rows, columns=MANIFEST_COLUMNS)
+
+
+def run_similarity(recordings, cache_dir, max_workers=None, batch_size=64):
+    """
+    All-pairs scanpath similarity between the subjects of every stimulus. Cached pairs are read
+    in this process; the others are compared in batches in a process pool and then cached.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    scanpaths = {path: load_scanpath(path) for path in recordings.fixation_data.unique()}
+
+    rows, pending = [], []
+    for stimulus, group in recordings.groupby('stimulus', sort=True):
+        group = group.sort_values('subject', key=lambda column: column.map(pupil_batch.subject_number))
+        for first, second in itertools.combinations(group.itertuples(index=False), 2):
+            key = _pair_key(first.fixation_data, second.fixation_data)
+            row = {'stimulus': stimulus, 'subject_a': first.subject, 'subject_b': second.subject,
+                   'fixations_a': len(scanpaths[first.fixation_data]['x']),
+                   'fixations_b': len(scanpaths[second.fixation_data]['x'])}
+            rows.append(row)
+            cached = _read_cached_pair(cache_dir, key)
+            if cached is None:
+                pending.append((key, row, scanpaths[first.fixation_data], scanpaths[second.fixation_data]))
+            else:
+                row.update(cached)
+    print(f"{len(rows)} pairs, {len(rows) - len(pending)} cached, comparing {len(pending)}")
+
+    rows_by_key = {key: row for key, row, _, _ in pending}
+    batches = [[(key, a, b) for key, _, a, b in pending[start:start + batch_size]]
+               for start in range(0, len(pending), batch_size)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(compare_pairs, batch) for batch in batches]
+        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+            for key, metrics in future.result():
+                rows_by_key[key].update(metrics)
+                _write_cached_pair(cache_dir, key, metrics)
+
+    columns = ['stimulus', 'subject_a', 'subject_b', 'fixations_a', 'fixations_b'] + METRICS
+    return pd.DataFrame(rows, columns=columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pairwise scanpath similarity between the subjects of every stimulus.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--root', help='Directory tree searched for fixations.csv exports below subject_N directories')
+    source.add_argument('--manifest', help=f"CSV manifest with columns: {', '.join(MANIFEST_COLUMNS)}")
+    parser.add_argument('--output', default='scanpath_similarity.csv', help='Path of the output CSV')
+    parser.add_argument('--cache-dir', help='Directory of cached pair results (default: <root or manifest dir>/'
+                                            '.scanpath_cache)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of worker processes')
+    args = parser.parse_args()
+
+    if args.manifest:
+        recordings = pd.read_csv(args.manifest)
+        missing = set(MANIFEST_COLUMNS) - set(recordings.columns)
+        if missing:
+            print(f"Error: Manifest is missing columns: {', '.join(sorted(missing))}")
+            return
+        base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    else:
+        recordings = discover_recordings(args.root)
+        base_dir = args.root
+
+    cache_dir = args.cache_dir or os.path.join(base_dir, '.scanpath_cache')
+    table = run_similarity(recordings, cache_dir, max_workers=args.jobs)
+    table.to_csv(args.output, index=False)
+    print(f"{table.stimulus.nunique()} stimuli, {len(table)} pairs. Similarities written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# The tools are top-level scripts, importable from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temporal_Heatpmap_DP import GazeFrameIndex  # noqa: E402
+
+FRAME_SIZE = (120, 160)
+FRAME_COUNT = 30
+
+
+@pytest.fixture
+def world_video(tmp_path):
+    """A short mp4v video whose frames differ, like a Pupil world video."""
+    path = str(tmp_path / 'world.mp4')
+    height, width = FRAME_SIZE
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (width, height))
+    for frame_idx in range(FRAME_COUNT):
+        frame = np.full((height, width, 3), 40, dtype=np.uint8)
+        cv2.rectangle(frame, (frame_idx * 4, 20), (frame_idx * 4 + 30, 60), (0, 200, 0), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def frame_count():
+    """Number of frames in world_video and of gaze_index."""
+    return FRAME_COUNT
+
+
+def _make_gaze_index(frame_count=FRAME_COUNT, samples_per_frame=4, first_index=10, seed=0):
+    """Random gaze on every frame except a gap, starting at world_index first_index."""
+    rng = np.random.default_rng(seed)
+    world_index = np.repeat(np.arange(first_index, first_index + frame_count), samples_per_frame)
+    keep = (world_index < first_index + 8) | (world_index >= first_index + 12)
+    world_index = world_index[keep]
+    return GazeFrameIndex(world_index, rng.uniform(0.05, 0.95, len(world_index)),
+                          rng.uniform(0.05, 0.95, len(world_index)))
+
+
+@pytest.fixture
+def make_gaze_index():
+    """Builder of gaze indexes with other lengths or densities than gaze_index."""
+    return _make_gaze_index
+
+
+@pytest.fixture
+def gaze_index():
+    return _make_gaze_index()
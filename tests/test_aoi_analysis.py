@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from aoi_analysis import Aoi
+
+BOX = {'box': [0.2, 0.2, 0.6, 0.6]}
+
+
+def test_interpolates_between_keyframes():
+    aoi = Aoi.from_keyframes('moving', [{'frame': 20, 'box': [0.4, 0.2, 0.8, 0.6]}, {'frame': 10, **BOX}], 25)
+    assert (aoi.start_frame, aoi.end_frame) == (10, 25)
+    np.testing.assert_allclose(aoi.polygons[5, 0], [0.3, 0.2])
+    assert aoi.contains(np.array([9, 10, 15, 25, 26]), np.full(5, 0.65), np.full(5, 0.4)).tolist() == \
+        [False, False, True, True, False]
+
+
+@pytest.mark.parametrize('keyframes, end_frame, message', [
+    ([{'frame': 10, **BOX}], 9, 'ends on frame 9, before its first keyframe 10'),
+    ([{'frame': 10, **BOX}, {'frame': 30, **BOX}], 5, 'ends on frame 5'),
+    ([], None, 'has no keyframes'),
+    ([{'frame': 10, **BOX}, {'frame': 10, **BOX}], None, 'has several keyframes on the same frame'),
+])
+def test_invalid_keyframes_name_the_aoi(keyframes, end_frame, message):
+    with pytest.raises(ValueError, match=f"AOI fight {message}"):
+        Aoi.from_keyframes('fight', keyframes, end_frame)
+
+
+def test_contains_float_frames_with_nan():
+    aoi = Aoi.from_keyframes('still', [{'frame': 10, **BOX}], 20)
+    frames = np.array([np.nan, 9.0, 10.0, 15.0, 20.0, np.nan, 21.0])
+    hits = aoi.contains(frames, np.full(len(frames), 0.4), np.full(len(frames), 0.4))
+    assert hits.tolist() == [False, False, True, True, True, False, False]
@@ -0,0 +1,52 @@
+import os
+
+import pandas as pd
+
+from batch_render import is_up_to_date, run_batch
+
+OPTIONS = {'scale': 1.0, 'pipeline': False, 'reuse_buffers': False,
+           'heatmap': dict(kernel='splat', grid_scale=2, sigma=5.0, decay=None, window=None)}
+
+
+def write_export(export_dir, video_path, frame_count):
+    """A Pupil Player export with gaze on every frame and one fixation, rendering onto video_path."""
+    os.makedirs(export_dir)
+    pd.DataFrame({'world_index': range(frame_count), 'norm_pos_x': 0.5, 'norm_pos_y': 0.5}).to_csv(
+        os.path.join(export_dir, 'gaze_positions.csv'), index=False)
+    pd.DataFrame({'id': [0], 'start_frame_index': [2], 'end_frame_index': [12], 'norm_pos_x': [0.4],
+                  'norm_pos_y': [0.6]}).to_csv(os.path.join(export_dir, 'fixations.csv'), index=False)
+    return {
+        'video_path': video_path,
+        'gaze_positions': os.path.join(export_dir, 'gaze_positions.csv'),
+        'fixation_data': os.path.join(export_dir, 'fixations.csv'),
+        'heatmap_video': os.path.join(export_dir, 'heatmap_video.mp4'),
+        'fixation_video': os.path.join(export_dir, 'fixation_video.mp4'),
+    }
+
+
+def test_missing_input_is_not_up_to_date(tmp_path, world_video, frame_count):
+    job = write_export(str(tmp_path / 'export'), world_video, frame_count)
+    for path in (job['heatmap_video'], job['fixation_video']):
+        open(path, 'w').close()
+    assert is_up_to_date(job)
+
+    assert not is_up_to_date({**job, 'video_path': None})
+    assert not is_up_to_date({**job, 'video_path': float('nan')})
+    os.remove(job['fixation_data'])
+    assert not is_up_to_date(job)
+
+
+def test_missing_input_does_not_stop_batch(tmp_path, world_video, frame_count):
+    jobs = [write_export(str(tmp_path / name), world_video, frame_count) for name in ('first', 'broken', 'last')]
+    # Outputs of an earlier run make the up-to-date check look at the missing inputs
+    for path in (jobs[1]['heatmap_video'], jobs[1]['fixation_video']):
+        open(path, 'w').close()
+    jobs[1]['video_path'] = None
+    os.remove(jobs[1]['gaze_positions'])
+
+    summary = run_batch(jobs, OPTIONS, max_workers=2)
+
+    assert summary['rendered'] == 2 and summary['skipped'] == 0
+    assert [failure['heatmap_video'] for failure in summary['failures']] == [jobs[1]['heatmap_video']]
+    assert summary['failures'][0]['error'].startswith('Missing input')
+    assert is_up_to_date(jobs[0]) and is_up_to_date(jobs[2])
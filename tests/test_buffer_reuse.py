@@ -0,0 +1,46 @@
+import tracemalloc
+
+import numpy as np
+
+from Temporal_Heatpmap_DP import FrameHeatmap, HeatmapSink, SplatKernel
+
+# Bytes a steady-state frame may allocate: a few Python scalars, far below one grid row
+ALLOWED_BYTES = 4096
+
+
+def allocated_per_frame(step, frames, warmup=10):
+    """Peak traced allocation of each call to step(i) beyond the memory held before it, after warmup calls."""
+    for i in range(warmup):
+        step(i)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(warmup, warmup + frames):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            step(i)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def test_splat_frame_heatmap_reuses_buffer():
+    rng = np.random.default_rng(0)
+    frames = [(rng.uniform(0, 720, n), rng.uniform(0, 1280, n)) for n in rng.integers(1, 9, 120)]
+    accumulator = FrameHeatmap(SplatKernel((720, 1280), (360, 640)), reuse_buffer=True)
+
+    peaks = allocated_per_frame(lambda i: accumulator.update(i, frames[i]), 100)
+    assert max(peaks) < ALLOWED_BYTES
+
+
+def test_buffered_heatmap_sink_reuses_buffers(tmp_path, make_gaze_index):
+    gaze_index = make_gaze_index(frame_count=150, samples_per_frame=6)
+    sink = HeatmapSink(str(tmp_path / 'heatmap.mp4'), gaze_index)
+    sink.open(640, 360, 30, buffer_count=1)
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    try:
+        peaks = allocated_per_frame(lambda i: sink.overlay(i, frame), 100)
+    finally:
+        sink.close()
+    assert max(peaks) < ALLOWED_BYTES
@@ -0,0 +1,38 @@
+import argparse
+
+import pytest
+
+from Temporal_Heatpmap_DP import add_heatmap_arguments, add_render_arguments, heatmap_options
+
+
+def parse(*argv):
+    parser = argparse.ArgumentParser()
+    add_heatmap_arguments(parser)
+    return heatmap_options(parser.parse_args(argv))
+
+
+def test_valid_trails():
+    assert parse('--decay', '0.9')['decay'] == 0.9
+    assert parse('--window', '1')['window'] == 1
+    assert parse()['decay'] is None and parse()['window'] is None
+
+
+@pytest.mark.parametrize('argv', [['--decay', '1'], ['--decay', '1.5'], ['--decay', '0'], ['--decay', '-0.2'],
+                                  ['--decay', 'nan'], ['--decay', 'fast'], ['--window', '0'], ['--window', '-3'],
+                                  ['--window', '2.5']])
+def test_invalid_trails_are_rejected(argv, capsys):
+    with pytest.raises(SystemExit):
+        parse(*argv)
+    assert f"argument {argv[0]}:" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('workers, modes, expected', [
+    (False, True, {'scale', 'pipeline', 'reuse_buffers'}),
+    (True, True, {'scale', 'workers', 'pipeline', 'reuse_buffers'}),
+    (False, False, {'scale'}),
+])
+def test_render_arguments(workers, modes, expected):
+    parser = argparse.ArgumentParser()
+    add_render_arguments(parser, workers=workers, modes=modes)
+    assert set(vars(parser.parse_args([]))) == expected
+    assert parser.parse_args(['--scale', '0.5']).scale == 0.5
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import export_cache
+
+
+@pytest.fixture
+def gaze_csv(tmp_path):
+    path = tmp_path / 'gaze_positions.csv'
+    pd.DataFrame({'gaze_timestamp': np.arange(6) / 120, 'world_index': [0, 0, 1, 1, 2, 2],
+                  'confidence': 0.9, 'norm_pos_x': 0.5, 'norm_pos_y': 0.25}).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.mark.parametrize('damage', ['remove', 'truncate'])
+def test_column_replaced_after_meta_read_reparses(gaze_csv, damage):
+    export_cache.load_gaze_positions(gaze_csv)
+    expected = export_cache.parse_export(gaze_csv, export_cache.GAZE_POSITIONS)
+    path = export_cache._cache_path(gaze_csv, export_cache.GAZE_POSITIONS)
+    column_path = os.path.join(path, 'world_index.npy')
+    # What a reader sees when a concurrent rebuild swaps the cache directory under it
+    if damage == 'remove':
+        os.remove(column_path)
+    else:
+        with open(column_path, 'r+b') as column_file:
+            column_file.truncate(16)
+
+    assert export_cache._read_cache(path, export_cache.source_key(gaze_csv)) is None
+    reloaded = export_cache.load_gaze_positions(gaze_csv)
+    assert list(reloaded.columns) == list(expected.columns)
+    for column in expected.columns:
+        np.testing.assert_array_equal(np.asarray(reloaded[column]), np.asarray(expected[column]))
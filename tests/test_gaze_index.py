@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from Temporal_Heatpmap_DP import load_aggregate_heatmap_sink, load_heatmap_sink
+
+
+def write_gaze(path):
+    """Gaze on frames 3 to 5 with rows missing a frame or position, as Pupil Player writes them."""
+    pd.DataFrame({
+        'gaze_timestamp': np.arange(8) / 120,
+        'world_index': [np.nan, 3, 3, 4, np.nan, 5, 5, 5],
+        'confidence': 0.9,
+        'norm_pos_x': [0.1, 0.2, 0.3, 0.4, 0.5, np.nan, 0.7, 0.8],
+        'norm_pos_y': [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, np.nan],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def test_rows_without_frame_or_position_are_dropped(tmp_path):
+    gaze_positions = write_gaze(tmp_path / 'gaze_positions.csv')
+    for gaze_index in (load_heatmap_sink(gaze_positions, None).gaze_index,
+                       load_aggregate_heatmap_sink([gaze_positions], None).gaze_indexes[0]):
+        assert gaze_index.first_index == 3
+        assert [gaze_index.samples(world_index)[0].tolist() for world_index in (3, 4, 5)] == \
+            [[np.float32(0.2), np.float32(0.3)], [np.float32(0.4)], [np.float32(0.7)]]
+        assert gaze_index.samples(2) is None and gaze_index.samples(6) is None
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from Temporal_Heatpmap_DP import HistogramKernel, SplatKernel
+
+
+def gaze_points(rng, frame_size, count):
+    """Random gaze pixels with points on every frame border and some outside the frame or NaN."""
+    height, width = frame_size
+    gaze_y = rng.uniform(0, height, count)
+    gaze_x = rng.uniform(0, width, count)
+    border_y = np.array([0, height, 0, height, height / 2, height / 2, 0, height])
+    border_x = np.array([0, width, width, 0, 0, width, width / 2, width / 2])
+    outside_y = np.array([-1, height + 1, height / 2, height / 2, np.nan, 5.0])
+    outside_x = np.array([width / 2, width / 2, -0.5, width + 0.5, 5.0, np.nan])
+    return np.concatenate([gaze_y, border_y, outside_y]), np.concatenate([gaze_x, border_x, outside_x])
+
+
+@pytest.mark.parametrize('frame_size, grid_scale', [((240, 320), 2), ((90, 160), 1), ((135, 241), 3), ((20, 30), 2)])
+@pytest.mark.parametrize('sigma', [1.0, 2.5, 5.0, 12.0])
+def test_splat_matches_histogram(frame_size, grid_scale, sigma):
+    rng = np.random.default_rng(int(sigma * 10) + frame_size[0])
+    grid = (frame_size[0] // grid_scale, frame_size[1] // grid_scale)
+    gaze_y, gaze_x = gaze_points(rng, frame_size, 50)
+
+    expected = HistogramKernel(frame_size, grid, sigma)(gaze_y, gaze_x)
+    actual = SplatKernel(frame_size, grid, sigma)(gaze_y, gaze_x)
+    np.testing.assert_allclose(actual, expected, rtol=1e-12, atol=1e-12 * expected.max())
+
+
+def test_splat_accumulate_is_weighted_sum():
+    frame_size, grid = (120, 160), (60, 80)
+    rng = np.random.default_rng(0)
+    kernel = SplatKernel(frame_size, grid, 3.0)
+    first, second = gaze_points(rng, frame_size, 20), gaze_points(rng, frame_size, 30)
+
+    out = np.zeros(grid)
+    kernel.accumulate(out, *first, 2.0)
+    kernel.accumulate(out, *second, -0.5)
+    expected = 2.0 * HistogramKernel(frame_size, grid, 3.0)(*first) - 0.5 * HistogramKernel(frame_size, grid, 3.0)(*second)
+    np.testing.assert_allclose(out, expected, rtol=1e-12, atol=1e-12 * np.abs(expected).max())
+
+
+def test_splat_ignores_frames_without_points_in_range():
+    kernel = SplatKernel((40, 60), (20, 30), 2.0)
+    out = kernel(np.array([-5.0, np.nan]), np.array([10.0, 10.0]))
+    assert not out.any()
+
+
+def test_bin_matches_searchsorted():
+    edges = np.linspace(0, 135, 46)
+    values = np.concatenate([edges, np.nextafter(edges, -np.inf), np.nextafter(edges, np.inf),
+                             np.random.default_rng(0).uniform(-5, 140, 200)])
+    expected = np.searchsorted(edges, values, side='right') - 1
+    expected[values == edges[-1]] = len(edges) - 2
+    actual = [SplatKernel._bin(value, edges.tolist()) for value in values]
+    np.testing.assert_array_equal(actual, expected)
+    assert not 0 <= SplatKernel._bin(np.nan, edges.tolist()) < len(edges) - 1
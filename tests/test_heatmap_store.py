@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from heatmap_store import HeatmapStore, HeatmapStoreWriter
+from Temporal_Heatpmap_DP import DecayingHeatmap, HeatmapSink, SplatKernel
+
+WIDTH, HEIGHT = 64, 48
+
+
+def reference_trail(sink, frame_count, decay=None, window=None):
+    """The trail of every frame summed directly from the per-frame heatmaps, None without any gaze yet."""
+    kernel = SplatKernel((HEIGHT, WIDTH), (HEIGHT // sink.grid_scale, WIDTH // sink.grid_scale), sink.sigma)
+    frames = [sink.gaze_pixels(frame_idx + sink.offset) for frame_idx in range(frame_count)]
+    heatmaps = [None if samples is None else kernel(*samples) for samples in frames]
+
+    trails = []
+    for frame_idx in range(frame_count):
+        first = 0 if window is None else max(frame_idx - window + 1, 0)
+        terms = [heatmap * (1.0 if decay is None else decay ** (frame_idx - k))
+                 for k, heatmap in enumerate(heatmaps[first:frame_idx + 1], first) if heatmap is not None]
+        trails.append(sum(terms) if terms else None)
+    return trails
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'float16'])
+@pytest.mark.parametrize('trail', [{'decay': 0.5}, {'decay': 0.9}, {'window': 3}, {'window': 12}])
+def test_store_round_trip_matches_trail(tmp_path, gaze_index, frame_count, trail, dtype, monkeypatch):
+    # Rescale often, so stored grids cross several gain resets
+    monkeypatch.setattr(DecayingHeatmap, 'MAX_GAIN', 1e3)
+    writer = HeatmapStoreWriter(str(tmp_path / 'grids'), dtype, chunk_frames=8)
+    sink = HeatmapSink(None, gaze_index, grid_store=writer, **trail)
+    sink.open(WIDTH, HEIGHT, 30)
+    for frame_idx in range(frame_count):
+        sink.overlay(frame_idx, None)
+    sink.close()
+
+    expected = reference_trail(sink, frame_count, **trail)
+    frame_indices, grids = HeatmapStore(writer.path).read(dtype=np.float64)
+    assert frame_indices.tolist() == [i for i, grid in enumerate(expected) if grid is not None]
+    step = 1 / 255 if dtype == 'uint8' else 2 ** -10
+    for frame_idx, grid in zip(frame_indices, grids):
+        reference = expected[frame_idx]
+        np.testing.assert_allclose(grid, reference, rtol=0, atol=step * reference.max())
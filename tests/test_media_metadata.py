@@ -0,0 +1,56 @@
+import json
+
+import media_metadata
+from ffmpeg_scheduler import JobResult
+from media_metadata import MediaMetadataCache
+
+PROBE_OUTPUT = json.dumps({'format': {'duration': '12.5'},
+                           'streams': [{'codec_name': 'h264', 'width': 640, 'height': 480, 'avg_frame_rate': '30/1'}],
+                           'packets': []}).encode()
+
+
+def fake_probes(monkeypatch, outcome):
+    """Replace ffprobe by outcome(path) -> (returncode, stdout); returns the list of probed paths."""
+    probed = []
+
+    def run_jobs(jobs, *args, **kwargs):
+        results = []
+        for job in jobs:
+            probed.append(job.name)
+            returncode, stdout = outcome(job.name)
+            error = None if returncode == 0 else f"Exited with code {returncode}: Invalid data"
+            results.append(JobResult(job, returncode, stdout, b'', 1, 0.0, error))
+        return results
+
+    monkeypatch.setattr(media_metadata, 'run_jobs', run_jobs)
+    return probed
+
+
+def test_failed_probes_are_retried_after_ttl(tmp_path, monkeypatch):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'not a video')
+    db_path = str(tmp_path / 'media.sqlite')
+    probed = fake_probes(monkeypatch, lambda path: (1, b''))
+
+    with MediaMetadataCache(db_path) as cache:
+        assert cache.get([str(video)]) == [None]
+        assert cache.get([str(video)]) == [None]
+    assert probed == [str(video)]
+
+    # Once the entry is older than the TTL the file is probed again and the success replaces it
+    probed = fake_probes(monkeypatch, lambda path: (0, PROBE_OUTPUT))
+    with MediaMetadataCache(db_path, failed_probe_ttl=0) as cache:
+        assert cache.get([str(video)])[0]['duration'] == 12.5
+    assert probed == [str(video)]
+
+
+def test_successful_probes_do_not_expire(tmp_path, monkeypatch):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'video')
+    db_path = str(tmp_path / 'media.sqlite')
+    probed = fake_probes(monkeypatch, lambda path: (0, PROBE_OUTPUT))
+
+    with MediaMetadataCache(db_path, failed_probe_ttl=0) as cache:
+        first = cache.get([str(video)])
+        assert cache.get([str(video)]) == first
+    assert probed == [str(video)] and first[0]['codec'] == 'h264'
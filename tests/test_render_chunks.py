@@ -0,0 +1,70 @@
+import os
+import shutil
+
+import cv2
+import pytest
+
+import Temporal_Heatpmap_DP as heatmap
+import heatmap_store
+
+
+class CopySink(heatmap.OverlaySink):
+    name = "Copy"
+
+    def overlay(self, frame_idx, frame):
+        return frame
+
+
+class FailingSink(heatmap.OverlaySink):
+    name = "Failing"
+
+    def overlay(self, frame_idx, frame):
+        if frame_idx == 5:
+            raise RuntimeError("overlay failed")
+        return frame
+
+
+def count_frames(path):
+    cap = cv2.VideoCapture(path)
+    count = 0
+    while cap.read()[0]:
+        count += 1
+    cap.release()
+    return count
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='joining parts needs ffmpeg')
+def test_parallel_render_skips_chunks_without_frames(world_video, frame_count, tmp_path, monkeypatch):
+    # The container claims three times the frames it holds, so the last two chunks decode nothing
+    monkeypatch.setattr(heatmap, 'get_video_frame_count', lambda video_path: 3 * frame_count)
+    output_path = str(tmp_path / 'copy.mp4')
+    heatmap.render_overlays_parallel(world_video, [CopySink(output_path)], workers=3)
+
+    assert count_frames(output_path) == frame_count
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('overlay_parts_')]
+
+
+def test_parallel_render_without_decodable_frames_raises(tmp_path, frame_count, monkeypatch):
+    video_path = str(tmp_path / 'broken.mp4')
+    with open(video_path, 'wb') as video_file:
+        video_file.write(b'not a video')
+    monkeypatch.setattr(heatmap, 'get_video_frame_count', lambda video_path: frame_count)
+
+    with pytest.raises(RuntimeError, match='No frames could be decoded'):
+        heatmap.render_overlays_parallel(video_path, [CopySink(str(tmp_path / 'out.mp4'))], workers=2)
+
+
+def test_failed_render_releases_writers_without_finishing_grid_store(world_video, gaze_index, tmp_path):
+    store_path = str(tmp_path / 'grids')
+    sinks = [
+        heatmap.HeatmapSink(str(tmp_path / 'heatmap.mp4'), gaze_index,
+                            grid_store=heatmap_store.HeatmapStoreWriter(store_path)),
+        FailingSink(str(tmp_path / 'failing.mp4')),
+    ]
+    with pytest.raises(RuntimeError, match='overlay failed'):
+        heatmap.render_frame_range(world_video, sinks, progress=False)
+
+    assert all(sink.video_writer is None for sink in sinks)
+    # Without meta.json the partial store is not mistaken for a complete one
+    assert not os.path.exists(os.path.join(store_path, 'meta.json'))
+    assert count_frames(str(tmp_path / 'failing.mp4')) == 5
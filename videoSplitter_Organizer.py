@@ -1,9 +1,12 @@
 import os
 import random
 import pandas as pd
-import subprocess
 import shutil
 
+from ffmpeg_scheduler import run_jobs
+from media_metadata import load_durations
+from video_segments import segment_jobs
+
 # Configurations
 num_people = 25
 videos_per_person_per_class = 5
@@ -11,75 +14,44 @@ files_per_label = 5
 label_0 = 0
 label_1 = 1
 output_base_dir = "/data/mkhan/experimental_dataV2"  # Specify where to save split videos
+ffmpeg_jobs = os.cpu_count()  # ffmpeg and ffprobe processes run at once
+probe_timeout = 60  # Seconds before an ffprobe call is abandoned (metadata cache misses only)
+encode_timeout = None  # Seconds before an ffmpeg encode is abandoned, None waits indefinitely
+job_retries = 1  # Extra attempts for a failed or timed out call
+segment_mode = 'segment'  # 'segment' (one pass), 'seek' (one job per part) or 'copy' (no re-encode, keyframe cuts)
 
 required_videos_per_label = files_per_label * num_people
 
-# Function to split videos or save short ones directly using ffmpeg
-def process_video(input_path, save_dir):
-    """Process the video: Split if longer than a minute, save directly if shorter."""
-    print(f"Processing: {input_path}")
-
-    base_name = os.path.splitext(os.path.basename(input_path))[0]
-    video_dir = os.path.join(save_dir, base_name)
-    os.makedirs(video_dir, exist_ok=True)
-
-    # Get the duration of the video using ffmpeg
-    result = subprocess.run(
-        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", input_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
-    )
-    duration = float(result.stdout)
-
-    print(f"Loaded: {input_path}, Duration: {duration:.2f} seconds")
-
-    if duration < 60:  # Save short videos directly
-        output_path = os.path.join(video_dir, f"{base_name}.mp4")
-        subprocess.run(["ffmpeg", "-i", input_path, "-c:v", "libx264", output_path])
-        print(f"Saved short video: {output_path}")
-        return
-
-    # Split video into 5 parts or handle leftover duration
-    total_duration = min(duration, 300)  # Limit to 5 minutes
-    segment_duration = total_duration / 5
-    segments = []
-    start = 0
-
-    for i in range(5):
-        end = min(start + segment_duration, total_duration)
-        segment_path = os.path.join(video_dir, f"part_{i + 1}.mp4")
-        subprocess.run(["ffmpeg", "-i", input_path, "-ss", str(start), "-to", str(end), "-c:v", "libx264", segment_path])
-        segments.append(segment_path)
-        print(f"Segment {i + 1}: {end - start:.2f} seconds")
-        start = end
-        if start >= total_duration:
-            break
-
-    if duration > total_duration:
-        leftover_path = os.path.join(video_dir, f"leftover.mp4")
-        subprocess.run(["ffmpeg", "-i", input_path, "-ss", str(total_duration), "-c:v", "libx264", leftover_path])
-        segments.append(leftover_path)
-        print(f"Leftover Segment: {duration - total_duration:.2f} seconds")
-
-    print(f"Processed {input_path} into {len(segments)} segments.")
+def report_job(result):
+    """Print the outcome of an ffmpeg job."""
+    if result.ok:
+        print(result.job.name)
+    else:
+        print(f"FFmpeg error in {result.job.name}: {result.error}")
+
+def process_videos(video_files, save_dir):
+    """Probe all videos, then run their split jobs concurrently."""
+    durations = load_durations(video_files, max_concurrency=ffmpeg_jobs, timeout=probe_timeout, retries=job_retries)
+    jobs = []
+    for video_path, duration in zip(video_files, durations):
+        if duration is not None:
+            print(f"Loaded: {video_path}, Duration: {duration:.2f} seconds")
+            jobs.extend(segment_jobs(video_path, duration, save_dir, mode=segment_mode, timeout=encode_timeout))
+
+    results = run_jobs(jobs, max_concurrency=ffmpeg_jobs, retries=job_retries, on_result=report_job)
+    print(f"Processed {len(video_files)} videos, {sum(not result.ok for result in results)} of {len(jobs)} ffmpeg jobs failed.")
 
 def filter_videos_by_duration(video_paths, min_duration=10):
     """Filter out videos with a duration less than the minimum duration."""
     valid_videos = []
-    for path in video_paths:
-        try:
-            result = subprocess.run(
-                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            duration = float(result.stdout)
-            if duration >= min_duration:
-                valid_videos.append(path)
-            else:
-                print(f"Skipped {path}: Duration {duration:.2f} seconds (too short)")
-        except Exception as e:
-            print(f"Error loading {path}: {e}")
+    durations = load_durations(video_paths, max_concurrency=ffmpeg_jobs, timeout=probe_timeout, retries=job_retries)
+    for path, duration in zip(video_paths, durations):
+        if duration is None:
+            continue
+        if duration >= min_duration:
+            valid_videos.append(path)
+        else:
+            print(f"Skipped {path}: Duration {duration:.2f} seconds (too short)")
     return valid_videos
 
 # Load CSV files
@@ -156,5 +128,4 @@ if missing_label_0 > 0:
     raise ValueError("Not enough videos for label 0.")
 
 print("Processing label 0 videos...")
-for video_path in label_0_files[:required_videos_per_label]:
-    process_video(video_path, os.path.join(output_base_dir, f"label_0"))
\ No newline at end of file
+process_videos(label_0_files[:required_videos_per_label], os.path.join(output_base_dir, f"label_0"))
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+
+from ffmpeg_scheduler import Job
+
+"""
+FFmpeg commands that save a short video or split a long one into equal parts plus the leftover
+beyond the cap. Segment modes:
+
+    segment     one ffmpeg process decodes and encodes the video once; the segment muxer writes
+                the parts, cut at keyframes forced at the split points, and a second output
+                seeks past the cap for the leftover
+    seek        one job per part, each seeking on the input before decoding; cuts are frame
+                accurate and the parts encode in parallel
+    copy        like seek, but the streams are copied without re-encoding; parts start at the
+                keyframe before their split point, so cut points are only approximate
+"""
+SEGMENT_MODES = ('segment', 'seek', 'copy')
+
+# The forced keyframes can land a rounding error before their split time, which the segment
+# muxer would skip in favour of the next GOP; half a frame at 50 fps covers common frame rates
+SEGMENT_TIME_DELTA = 0.01
+
+
+def split_points(duration, parts=5, max_duration=300):
+    """Return the part boundaries [0, t1, ..., total] and the capped total duration."""
+    total_duration = min(duration, max_duration)
+    segment_duration = total_duration / parts
+    return [min(i * segment_duration, total_duration) for i in range(parts + 1)], total_duration
+
+
+def _codec(mode):
+    return ['-c', 'copy'] if mode == 'copy' else ['-c:v', 'libx264']
+
+
+def _seek_command(input_path, start, end, output_path, mode):
+    cmd = ['ffmpeg', '-y', '-ss', str(start), '-i', input_path]
+    if end is not None:
+        cmd += ['-t', str(end - start)]
+    cmd += _codec(mode)
+    if mode == 'copy':
+        cmd += ['-avoid_negative_ts', 'make_zero']
+    return cmd + [output_path]
+
+
+def segment_jobs(input_path, duration, save_dir, mode='segment', parts=5, max_duration=300, short_duration=60,
+                 timeout=None):
+    """Build the FFmpeg jobs that save a short video to save_dir/<name>/ or split a long one there."""
+    if mode not in SEGMENT_MODES:
+        raise ValueError(f"Unknown segment mode {mode}, use one of {', '.join(SEGMENT_MODES)}")
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    video_dir = os.path.join(save_dir, base_name)
+    os.makedirs(video_dir, exist_ok=True)
+
+    if duration < short_duration:  # Save short videos directly
+        output_path = os.path.join(video_dir, f"{base_name}.mp4")
+        return [Job(['ffmpeg', '-y', '-i', input_path] + _codec(mode) + [output_path],
+                    name=f"Saved short video: {output_path}", timeout=timeout)]
+
+    points, total_duration = split_points(duration, parts, max_duration)
+    leftover_path = os.path.join(video_dir, 'leftover.mp4')
+    has_leftover = duration > total_duration
+
+    if mode == 'segment':
+        cut_times = ','.join(str(point) for point in points[1:-1])
+        cmd = ['ffmpeg', '-y', '-i', input_path, '-t', str(total_duration), '-c:v', 'libx264',
+               '-force_key_frames', cut_times, '-f', 'segment', '-segment_times', cut_times,
+               '-segment_time_delta', str(SEGMENT_TIME_DELTA), '-segment_start_number', '1',
+               '-reset_timestamps', '1', os.path.join(video_dir, 'part_%d.mp4')]
+        name = f"{base_name}: {parts} segments of {total_duration / parts:.2f} seconds"
+        if has_leftover:
+            cmd += ['-ss', str(total_duration), '-c:v', 'libx264', leftover_path]
+            name += f", leftover segment: {duration - total_duration:.2f} seconds"
+        return [Job(cmd, name=name, timeout=timeout)]
+
+    jobs = []
+    for i, (start, end) in enumerate(zip(points[:-1], points[1:])):
+        segment_path = os.path.join(video_dir, f"part_{i + 1}.mp4")
+        jobs.append(Job(_seek_command(input_path, start, end, segment_path, mode),
+                        name=f"{base_name} segment {i + 1}: {end - start:.2f} seconds", timeout=timeout))
+    if has_leftover:
+        jobs.append(Job(_seek_command(input_path, total_duration, None, leftover_path, mode),
+                        name=f"{base_name} leftover segment: {duration - total_duration:.2f} seconds",
+                        timeout=timeout))
+    return jobs